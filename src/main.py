@@ -3,14 +3,36 @@ import yaml
 import json
 import logging
 import io
+import hashlib
+import collections
 import shutil
 import datetime
+import urllib.parse
+import difflib
+import itertools
+import sys
+import random
+import re
+import sqlite3
+import time
+import functools
+import threading
+import asyncio
+import queue
+import multiprocessing
 import typer
-from typing import Optional
-from google.auth.transport.requests import Request
+import httplib2
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+from multiprocessing import shared_memory
+from typing import Annotated, Optional
+from google.auth.transport.requests import AuthorizedSession, Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaIoBaseDownload, MediaIoBaseUpload
 import markdownify
 # Setup logging
@@ -27,9 +49,145 @@ app = typer.Typer()
 SCOPES = ['https://www.googleapis.com/auth/drive']
 CONFIG_FILE = 'config.yaml'
 STATE_FILE = 'state.json'
+# --state-backend: 'sqlite' keeps state in state.db, 'json' in STATE_FILE
+STATE_BACKENDS = ['sqlite', 'json']
+# SQLite state commits at most this many updates / seconds apart
+STATE_COMMIT_BATCH = 50
+STATE_COMMIT_INTERVAL = 5.0
 TOKEN_FILE = 'token.json'
 CREDENTIALS_FILE = 'credentials.json'
 
+DOC_MIME_TYPE = 'application/vnd.google-apps.document'
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+SHORTCUT_MIME_TYPE = 'application/vnd.google-apps.shortcut'
+
+# files().list page size; 1000 is the Drive API maximum
+PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 1000
+# --traversal: 'recursive' lists folder by folder, 'tree' enumerates
+# everything in one paginated query
+TRAVERSALS = ['recursive', 'tree']
+# What a whole-tree enumeration needs: docs, the folders holding them (and
+# shortcuts to folders) and the .md/.pdf outputs the skip/convert decision
+# looks for
+TREE_MIME_TYPES = [DOC_MIME_TYPE, FOLDER_MIME_TYPE, SHORTCUT_MIME_TYPE, 'text/markdown', 'application/pdf']
+# Every listing passes these and every other files() call passes
+# supportsAllDrives=True, so docs and outputs in shared drives are listed,
+# read and written like those in My Drive
+ALL_DRIVES_LIST = {'supportsAllDrives': True, 'includeItemsFromAllDrives': True}
+# Drive accepts at most 100 calls per batch request
+BATCH_SIZE = 100
+
+# State key holding the Changes API start page token for --incremental runs
+CHANGES_TOKEN_KEY = '_changes_page_token'
+# State key listing the docs whose conversion failed on the last run; the
+# next --incremental run retries them even if they were not edited again
+FAILED_DOCS_KEY = '_failed_docs'
+# State key holding the trie of resolved config paths, {'id', 'children': {name: node}}
+PATH_CACHE_KEY = '_folder_path_cache'
+
+# How get_service talks to Drive: 'httplib2' (one connection per thread),
+# 'requests' (every thread shares one pooled, gzip-compressed session) or
+# 'http2' (every thread shares one asyncio HTTP/2 client, needs httpx[http2])
+TRANSPORTS = ['httplib2', 'requests', 'http2']
+DEFAULT_TRANSPORT = 'httplib2'
+_transport = DEFAULT_TRANSPORT
+# Connections the shared HTTP/2 client keeps open; each multiplexes many calls
+HTTP2_MAX_CONNECTIONS = 4
+# Connections the shared requests session keeps alive to each host
+SESSION_POOL_SIZE = 16
+_pool_size = SESSION_POOL_SIZE
+HTTP_TIMEOUT = 60.0
+_shared_transport = None
+_shared_service = None
+_shared_transport_lock = threading.Lock()
+
+# Guards state and the conversion report when docs are converted on worker threads
+STATE_LOCK = threading.Lock()
+# Guards the set of folders already queued by listing threads
+VISITED_LOCK = threading.Lock()
+_thread_local = threading.local()
+# OAuth credentials loaded once by main(), so worker threads never re-read
+# or refresh token.json (or start the browser flow) themselves
+_credentials = None
+
+# Per-run counters surfaced in the conversion report
+RUN_STATS = collections.Counter()
+STATS_LOCK = threading.Lock()
+# IDs of the docs that failed to convert or upload this run
+FAILED_DOCS = set()
+STAT_LABELS = {
+    'uploads_skipped_unchanged': "Uploads skipped (content unchanged)",
+    'docs_unchanged_by_probe': "Documents unchanged after export probe (PDF export skipped)",
+    'native_export_fallbacks': "Documents converted with markdownify after the native export failed",
+    'conversions_timed_out': "Conversions killed after exceeding the time limit",
+    'retries': "Drive calls retried",
+    'retries_denied': "Retries refused (retry budget exhausted)",
+    'throttled': "Calls throttled by Drive (concurrency halved)",
+}
+
+# Retry policy for every Drive call: exponential backoff with full jitter,
+# at least Retry-After when the server sends one, and a shared per-run
+# budget so a hard outage fails fast instead of sleeping forever.
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded'}
+MAX_RETRIES = 6
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 64.0
+RETRY_BUDGET = 200
+
+# Client-side limits per class of Drive call: sustained calls/second, burst
+# size, and the ceiling for the adaptive concurrency limit. Exports have
+# their own, tighter, server-side quota.
+RATE_LIMITS = {
+    'metadata': {'rate': 50.0, 'burst': 50, 'max_concurrency': 32},
+    'export': {'rate': 10.0, 'burst': 10, 'max_concurrency': 8},
+    'upload': {'rate': 10.0, 'burst': 10, 'max_concurrency': 8},
+}
+INITIAL_CONCURRENCY = 4
+
+# Attributes Google regenerates on every HTML export (heading ids, kix
+# anchors and the links pointing at them); stripped before hashing.
+VOLATILE_HTML_PATTERNS = [
+    re.compile(r'\s(?:id|name)="[^"]*"'),
+    re.compile(r'\shref="#[^"]*"'),
+]
+
+# Google Docs HTML exports keep emphasis in a <style> block of generated
+# classes (.c3{font-weight:700}) and encode list nesting in the list's class
+# (lst-kix_<id>-<level>). The streaming converter reads both.
+DOCS_STYLE_RULE = re.compile(r'(?:^|(?<=\}))\s*\.([\w-]+)\s*\{([^}]*)\}')
+DOCS_LIST_LEVEL = re.compile(r'lst-kix_\w+-(\d+)')
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Background pool for PDF exports, owned by main() for the length of a run
+_export_pool = None
+
+# Markdown converters: 'native' is Drive's own text/markdown export, the
+# others convert the HTML export locally (see HTML_CONVERTERS). The native
+# export falls back to FALLBACK_CONVERTER for docs Drive refuses to export.
+DEFAULT_CONVERTER = 'native'
+FALLBACK_CONVERTER = 'markdownify'
+# Converter for the current run, set by run()
+_converter = DEFAULT_CONVERTER
+
+# Folders listed concurrently by the breadth-first crawl. More than one
+# lister moves conversions onto the pipeline, so by default docs still
+# convert inline with the PDF export overlapping the markdown one.
+LIST_WORKERS = 1
+
+# Queue capacity between pipeline stages, per --workers; bounds how many
+# exported documents are held in memory at once
+PIPELINE_QUEUE_SIZE_PER_WORKER = 2
+
+# Optional process pool for HTML conversions, owned by run(). A conversion
+# running longer than CONVERT_TIMEOUT seconds is killed; exports of at least
+# SHARED_MEMORY_THRESHOLD bytes reach the workers through shared memory.
+_convert_pool = None
+CONVERT_TIMEOUT = 300.0
+CONVERT_POLL_INTERVAL = 0.5
+SHARED_MEMORY_THRESHOLD = 1024 * 1024
+
 def load_config():
     if not os.path.exists(CONFIG_FILE):
         logging.error(f"Config file {CONFIG_FILE} not found.")
@@ -37,17 +195,120 @@ def load_config():
     with open(CONFIG_FILE, 'r') as f:
         return yaml.safe_load(f)
 
-def load_state():
-    if os.path.exists(STATE_FILE):
+class SqliteState(dict):
+    """State dict persisted to SQLite one key at a time.
+
+    Assignments and deletions are tracked and written by save() as upserts,
+    so recording one converted doc costs O(1) instead of rewriting the whole
+    file. Commits are batched; WAL keeps the database intact if the run dies
+    mid-write, at worst losing the last uncommitted batch.
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.conn.commit()
+        for key, value in self.conn.execute("SELECT key, value FROM state"):
+            super().__setitem__(key, json.loads(value))
+        self._dirty = set()
+        self._deleted = set()
+        self._uncommitted = 0
+        self._last_commit = time.monotonic()
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._dirty.add(key)
+        self._deleted.discard(key)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._deleted.add(key)
+        self._dirty.discard(key)
+
+    def pop(self, key, *default):
+        if key in self:
+            self._deleted.add(key)
+            self._dirty.discard(key)
+        return super().pop(key, *default)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def save(self, force=False):
+        if self._dirty:
+            self.conn.executemany(
+                "INSERT INTO state (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                [(key, json.dumps(self[key])) for key in self._dirty]
+            )
+        if self._deleted:
+            self.conn.executemany("DELETE FROM state WHERE key = ?", [(key,) for key in self._deleted])
+        self._uncommitted += len(self._dirty) + len(self._deleted)
+        self._dirty.clear()
+        self._deleted.clear()
+        if self._uncommitted and (force or self._uncommitted >= STATE_COMMIT_BATCH
+                                  or time.monotonic() - self._last_commit >= STATE_COMMIT_INTERVAL):
+            self.conn.commit()
+            self._uncommitted = 0
+            self._last_commit = time.monotonic()
+
+    def close(self):
+        self.save(force=True)
+        self.conn.close()
+
+def state_db_path():
+    return os.path.splitext(STATE_FILE)[0] + '.db'
+
+def load_state(backend='sqlite', read_only=False):
+    """Load run state for backend.
+
+    read_only (dry runs) returns a plain dict: the database is neither
+    created nor written and state.json is read in place instead of being
+    migrated.
+    """
+    if backend == 'json' or (read_only and not os.path.exists(state_db_path())):
+        if os.path.exists(STATE_FILE):
+            with open(STATE_FILE, 'r') as f:
+                return json.load(f)
+        return {}
+
+    if read_only:
+        conn = sqlite3.connect(f"file:{urllib.parse.quote(state_db_path())}?mode=ro", uri=True)
+        try:
+            return {key: json.loads(value) for key, value in conn.execute("SELECT key, value FROM state")}
+        except sqlite3.OperationalError:
+            # Created by a run that stopped before the table existed
+            return {}
+        finally:
+            conn.close()
+
+    state = SqliteState(state_db_path())
+    if not state and os.path.exists(STATE_FILE):
+        # One-time migration; the JSON file is kept aside rather than deleted
         with open(STATE_FILE, 'r') as f:
-            return json.load(f)
-    return {}
+            state.update(json.load(f))
+        state.save(force=True)
+        os.replace(STATE_FILE, STATE_FILE + '.migrated')
+        logging.info(f"Migrated {len(state)} state entries from {STATE_FILE} to {state.path}")
+    return state
 
 def save_state(state):
+    if isinstance(state, SqliteState):
+        state.save()
+        return
     with open(STATE_FILE, 'w') as f:
         json.dump(state, f, indent=2)
 
-def get_service():
+def close_state(state):
+    """Flush any batched state writes at the end of a run."""
+    if isinstance(state, SqliteState):
+        state.close()
+
+def get_credentials():
     creds = None
     if os.path.exists(TOKEN_FILE):
         creds = Credentials.from_authorized_user_file(TOKEN_FILE, SCOPES)
@@ -62,7 +323,326 @@ def get_service():
             creds = flow.run_local_server(port=0)
         with open(TOKEN_FILE, 'w') as token:
             token.write(creds.to_json())
-    return build('drive', 'v3', credentials=creds)
+    return creds
+
+@functools.lru_cache(maxsize=None)
+def drive_discovery_document():
+    """The Drive v3 discovery document as JSON, read once per process.
+
+    googleapiclient ships a copy, so building a client never fetches it.
+    None if this googleapiclient has no copy.
+    """
+    return discovery_cache.get_static_doc('drive', 'v3')
+
+def build_drive_service(**kwargs):
+    """Build a Drive v3 client from the memoised discovery document.
+
+    build_from_document fills in the method descriptions it is handed, so
+    every client parses its own copy rather than sharing one dict between
+    threads.
+    """
+    document = drive_discovery_document()
+    if document is None:
+        return build('drive', 'v3', **kwargs)
+    return build_from_document(document, **kwargs)
+
+def get_service(creds=None):
+    """Drive service for the run's transport, on creds or freshly loaded credentials."""
+    if _transport != 'httplib2':
+        return get_shared_service(creds)
+    creds = creds or get_credentials()
+    if not creds:
+        return None
+    return build_drive_service(credentials=creds)
+
+def gzip_headers(headers):
+    """Copy of headers that asks Drive for a gzip-compressed response.
+
+    Google APIs only compress responses for clients whose User-Agent
+    mentions gzip, whatever Accept-Encoding says.
+    """
+    headers = dict(headers or {})
+    headers['accept-encoding'] = 'gzip'
+    agent = headers.get('user-agent', '')
+    if 'gzip' not in agent:
+        headers['user-agent'] = f"{agent} (gzip)".strip()
+    return headers
+
+def httplib2_response(status, reason, headers, content):
+    """httplib2.Response for a response whose body the client library has already decoded.
+
+    Like httplib2, content-length is rewritten to the decoded size:
+    MediaIoBaseDownload takes it as the total size of a download.
+    """
+    info = {key.lower(): value for key, value in headers.items()}
+    info.pop('content-encoding', None)
+    info['content-length'] = str(len(content))
+    info['status'] = str(status)
+    info['reason'] = reason
+    return httplib2.Response(info)
+
+class SessionTransport:
+    """httplib2.Http stand-in that sends googleapiclient's requests through one pooled AuthorizedSession.
+
+    The session is shared by every thread: urllib3 keeps up to pool_size
+    connections to Drive alive between calls, and responses are requested
+    gzip-compressed. AuthorizedSession adds the token and refreshes it on 401.
+    """
+    def __init__(self, credentials, pool_size=SESSION_POOL_SIZE, timeout=HTTP_TIMEOUT):
+        self.credentials = credentials
+        self.timeout = timeout
+        self._session = AuthorizedSession(credentials)
+        # One pool per host: the Drive API and the token endpoint
+        adapter = requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+        self._session.mount('https://', adapter)
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=None, connection_type=None):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        try:
+            response = self._session.request(method, uri, data=body, headers=gzip_headers(headers), timeout=self.timeout)
+        except requests.Timeout as e:
+            raise TimeoutError(str(e)) from e
+        except requests.ConnectionError as e:
+            raise ConnectionError(str(e)) from e
+        return httplib2_response(response.status_code, response.reason, response.headers, response.content), response.content
+
+    def close(self):
+        self._session.close()
+
+class Http2Transport:
+    """httplib2.Http stand-in that sends googleapiclient's requests through one asyncio HTTP/2 client.
+
+    The event loop runs on its own thread and any thread may call request():
+    the call is handed to the loop and the caller waits for the response,
+    so the services of every worker share up to max_connections
+    multiplexed connections instead of one TLS connection per thread.
+    Responses are requested gzip-compressed.
+    Requests are authorised with credentials and retried once after a
+    token refresh on 401, as google_auth_httplib2.AuthorizedHttp does.
+    """
+    def __init__(self, credentials, max_connections=HTTP2_MAX_CONNECTIONS, timeout=HTTP_TIMEOUT, transport=None):
+        import httpx  # optional: uv sync --extra http2
+        self._httpx = httpx
+        # httpx logs every request at INFO
+        logging.getLogger('httpx').setLevel(logging.WARNING)
+        self.credentials = credentials
+        self._auth_lock = threading.Lock()
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="http2-loop", daemon=True)
+        self._thread.start()
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self._client = httpx.AsyncClient(http2=transport is None, limits=limits, timeout=timeout,
+                                         follow_redirects=True, transport=transport)
+
+    def _authorize(self, headers, rejected_token=None):
+        """Apply the current token, refreshing it first if it expired or is the one just rejected."""
+        with self._auth_lock:
+            if not self.credentials.valid or (rejected_token is not None and self.credentials.token == rejected_token):
+                self.credentials.refresh(Request())
+            self.credentials.apply(headers)
+            return self.credentials.token
+
+    async def _send(self, method, uri, body, headers):
+        return await self._client.request(method, uri, content=body, headers=headers)
+
+    def _call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=None, connection_type=None):
+        headers = gzip_headers(headers)
+        token = None
+        for _ in range(2):
+            token = self._authorize(headers, rejected_token=token)
+            try:
+                response = self._call(self._send(method, uri, body, headers))
+            except self._httpx.TimeoutException as e:
+                raise TimeoutError(str(e)) from e
+            except self._httpx.TransportError as e:
+                raise ConnectionError(str(e)) from e
+            if response.status_code != 401:
+                break
+        return httplib2_response(response.status_code, response.reason_phrase, response.headers, response.content), response.content
+
+    def close(self):
+        if self._loop.is_closed():
+            return
+        self._call(self._client.aclose())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+def get_shared_service(creds=None):
+    """Return the run's one Drive service on the shared transport for _transport.
+
+    Both are created on first use; the transports are thread-safe, so every
+    later caller gets the same service.
+    """
+    global _shared_transport, _shared_service
+    with _shared_transport_lock:
+        if _shared_service is None:
+            creds = creds or get_credentials()
+            if not creds:
+                return None
+            if _transport == 'requests':
+                _shared_transport = SessionTransport(creds, pool_size=_pool_size)
+            else:
+                try:
+                    _shared_transport = Http2Transport(creds)
+                except ImportError:
+                    logging.error("The http2 transport needs httpx with HTTP/2 support: uv sync --extra http2")
+                    return None
+            _shared_service = build_drive_service(http=_shared_transport)
+        return _shared_service
+
+def shutdown_shared_transport():
+    global _shared_transport, _shared_service
+    with _shared_transport_lock:
+        if _shared_transport is not None:
+            _shared_transport.close()
+            _shared_transport = None
+            _shared_service = None
+
+def sanitize_name(name):
+    """Reduce a Drive name to characters that are safe in a local path."""
+    return "".join([c for c in name if c.isalpha() or c.isdigit() or c in (' ', '-', '_')]).strip()
+
+def record_stat(name, count=1):
+    with STATS_LOCK:
+        RUN_STATS[name] += count
+
+def record_failure(file_id):
+    with STATS_LOCK:
+        FAILED_DOCS.add(file_id)
+
+def http_error_reason(error):
+    """First 'reason' from a Drive error body, e.g. 'rateLimitExceeded'."""
+    try:
+        return json.loads(error.content.decode('utf-8'))['error']['errors'][0].get('reason')
+    except Exception:
+        return None
+
+def is_retryable(error):
+    if isinstance(error, HttpError):
+        status = error.resp.status
+        return status in RETRYABLE_STATUSES or (status == 403 and http_error_reason(error) in RATE_LIMIT_REASONS)
+    return isinstance(error, (ConnectionError, TimeoutError, httplib2.HttpLib2Error))
+
+def retry_delay(attempt, error):
+    delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+    retry_after = error.resp.get('retry-after') if isinstance(error, HttpError) else None
+    if retry_after:
+        try:
+            delay = max(delay, float(retry_after))
+        except ValueError:
+            pass  # HTTP-date form; the backoff delay is used instead
+    return delay
+
+def take_retry_budget():
+    with STATS_LOCK:
+        if RUN_STATS['retries'] >= RETRY_BUDGET:
+            RUN_STATS['retries_denied'] += 1
+            return False
+        RUN_STATS['retries'] += 1
+        return True
+
+def is_throttled(error):
+    if not isinstance(error, HttpError):
+        return False
+    status = error.resp.status
+    return status == 429 or (status == 403 and http_error_reason(error) in RATE_LIMIT_REASONS)
+
+class AdaptiveLimiter:
+    """Token bucket with an AIMD concurrency cap for one class of Drive calls.
+
+    acquire() blocks until a token is available and fewer than `limit` calls
+    are in flight. Each successful call raises the limit by 1/limit (about
+    one slot per round of calls); a throttled call halves it.
+    """
+
+    def __init__(self, name, rate, burst, max_concurrency, initial_concurrency=INITIAL_CONCURRENCY):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.max_concurrency = max_concurrency
+        self.limit = float(min(initial_concurrency, max_concurrency))
+        self.in_flight = 0
+        self.updated = time.monotonic()
+        self.cond = threading.Condition()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        with self.cond:
+            while True:
+                self._refill()
+                if self.in_flight < int(self.limit) and self.tokens >= 1:
+                    self.tokens -= 1
+                    self.in_flight += 1
+                    return
+                # Wake up when the next token is due, or when a call finishes
+                timeout = (1 - self.tokens) / self.rate if self.tokens < 1 else None
+                self.cond.wait(timeout)
+
+    def release(self, throttled=False):
+        with self.cond:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(1.0, self.limit / 2)
+                logging.info(f"Drive throttled {self.name} calls, concurrency limit now {int(self.limit)}")
+            else:
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+            self.cond.notify_all()
+
+LIMITERS = {kind: AdaptiveLimiter(kind, **limits) for kind, limits in RATE_LIMITS.items()}
+
+def call_with_retry(call, description="Drive request", kind='metadata'):
+    """Run call() under the limiter for its kind, retrying transient failures."""
+    limiter = LIMITERS[kind]
+    attempt = 0
+    while True:
+        limiter.acquire()
+        try:
+            result = call()
+        except Exception as e:
+            throttled = is_throttled(e)
+            limiter.release(throttled=throttled)
+            if throttled:
+                record_stat('throttled')
+            if not is_retryable(e) or attempt >= MAX_RETRIES or not take_retry_budget():
+                raise
+            delay = retry_delay(attempt, e)
+            attempt += 1
+            logging.warning(f"{description} failed ({e}); retry {attempt}/{MAX_RETRIES} in {delay:.1f}s")
+            time.sleep(delay)
+        else:
+            limiter.release()
+            return result
+
+def execute_request(request, kind='metadata'):
+    """Execute a Drive request; kind picks the 'metadata', 'export' or 'upload' limiter."""
+    return call_with_retry(request.execute, kind=kind)
+
+def next_chunk_with_retry(downloader):
+    return call_with_retry(downloader.next_chunk, "Export download", kind='export')
+
+def get_thread_service():
+    """Return a Drive service owned by the calling thread.
+
+    httplib2 connections are not thread-safe, so every worker thread builds
+    its own service on first use, from the credentials main() loaded, and
+    keeps it for the rest of the run. With the requests and http2
+    transports every thread gets the same service.
+    """
+    service = getattr(_thread_local, 'service', None)
+    if service is None:
+        service = get_service(_credentials)
+        _thread_local.service = service
+    return service
 
 def backup_file(filepath, dry_run=False):
     if os.path.exists(filepath):
@@ -73,152 +653,1280 @@ def backup_file(filepath, dry_run=False):
             shutil.copy2(filepath, backup_path)
         logging.info(f"Backed up {filepath} to {backup_path}" + (" (Dry Run)" if dry_run else ""))
 
-def upload_file_to_drive(service, file_id, file_name, content, filename_suffix, mime_type, dry_run=False):
-    """Upload a file to Google Drive in the same folder as the original file."""
+def iter_drive_files(service, query, fields, page_size=PAGE_SIZE, **list_kwargs):
+    """Yield every file matching query, fetching one page at a time.
+
+    fields is the per-file field mask (e.g. "id, name"); nextPageToken is
+    always requested and followed until the listing is exhausted. Pages are
+    only fetched as the caller consumes them. Extra keyword arguments are
+    passed to files().list unchanged.
+    """
+    page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+    # Shared drive items are only listed when the request says it handles them
+    list_kwargs = dict(ALL_DRIVES_LIST, **list_kwargs)
+    page_token = None
+    while True:
+        results = execute_request(service.files().list(
+            q=query,
+            fields=f"nextPageToken, files({fields})",
+            pageSize=page_size,
+            pageToken=page_token,
+            **list_kwargs
+        ))
+        yield from results.get('files', [])
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            return
+
+def batch_get_files(service, file_ids, fields):
+    """Fetch metadata for many files with batched files().get calls.
+
+    Up to BATCH_SIZE gets share one HTTP round trip. Each response is
+    handled by its own callback: rate-limited or transient failures are
+    retried individually, anything else is logged and left out.
+    Returns {file_id: metadata}.
+    """
+    results = {}
+    file_ids = list(dict.fromkeys(file_ids))
+    for start in range(0, len(file_ids), BATCH_SIZE):
+        retry_ids = []
+
+        def callback(request_id, response, exception):
+            if exception is None:
+                results[request_id] = response
+            elif is_retryable(exception):
+                retry_ids.append(request_id)
+            else:
+                logging.warning(f"Batched lookup of {request_id} failed: {exception}")
+
+        batch = service.new_batch_http_request(callback=callback)
+        for file_id in file_ids[start:start + BATCH_SIZE]:
+            batch.add(service.files().get(fileId=file_id, fields=fields, supportsAllDrives=True), request_id=file_id)
+        execute_request(batch)
+
+        for file_id in retry_ids:
+            try:
+                results[file_id] = execute_request(service.files().get(fileId=file_id, fields=fields, supportsAllDrives=True))
+            except Exception as e:
+                logging.warning(f"Lookup of {file_id} failed: {e}")
+    return results
+
+class DriveNode:
+    """One Drive file or folder.
+
+    parent is the index of the parent node in DriveTree.nodes, or -1 when
+    the parent is unknown. name is None for a placeholder created because a
+    child named this node as its parent before the node itself was seen.
+    """
+    __slots__ = ('id', 'name', 'mime_type', 'modified_time', 'md5', 'parent', 'target')
+
+    def __init__(self, id, name=None, mime_type=None, modified_time=None, md5=None, parent=-1):
+        self.id = id
+        self.name = name
+        self.mime_type = mime_type
+        self.modified_time = modified_time
+        self.md5 = md5
+        self.parent = parent
+        # Folder a shortcut points at; None for everything else
+        self.target = None
+
+    @classmethod
+    def from_item(cls, item):
+        node = cls(item['id'])
+        node.update(item)
+        return node
+
+    def update(self, item):
+        """Copy the fields of a files() resource onto the node."""
+        self.name = item.get('name', self.name)
+        mime_type = item.get('mimeType')
+        if mime_type:
+            # A handful of distinct values shared by every node
+            self.mime_type = sys.intern(mime_type)
+        self.modified_time = item.get('modifiedTime', self.modified_time)
+        self.md5 = item.get('md5Checksum', self.md5)
+        details = item.get('shortcutDetails')
+        if details and details.get('targetMimeType') == FOLDER_MIME_TYPE:
+            self.target = details.get('targetId')
+
+class DriveTree:
+    """Compact in-memory snapshot of the part of Drive a run has seen.
+
+    Nodes live in one list and point at their parent by index. by_id maps a
+    Drive ID to its index, children maps a parent index to its child
+    indexes, and child_names maps (parent index, name) to the first child
+    with that name, which is what path lookups and the "does <name>.md
+    already exist" checks walk. A folder is only trusted to be complete once
+    it is in listed, or when the whole tree came from build_drive_tree.
+
+    paths indexes folders by their 'A/B/C' path below a base folder: My
+    Drive ('root') for configured paths, the configured root for folders a
+    scan reaches. path_keys is the reverse index the report reads.
+    """
+
+    def __init__(self):
+        self.nodes = []
+        self.by_id = {}
+        self.children = {}
+        self.child_names = {}
+        self.paths = {}
+        self.path_keys = {}
+        self.listed = set()
+        self.complete = False
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def _index_of(self, file_id):
+        index = self.by_id.get(file_id)
+        if index is None:
+            index = len(self.nodes)
+            self.nodes.append(DriveNode(file_id))
+            self.by_id[file_id] = index
+        return index
+
+    def add(self, item, parent_id=None):
+        """Add or refresh a files() resource, linking it under parent_id. Returns the node."""
+        with self.lock:
+            index = self._index_of(item['id'])
+            node = self.nodes[index]
+            node.update(item)
+            if parent_id is not None:
+                parent = self._index_of(parent_id)
+                key = (parent, node.name)
+                if self.child_names.get(key) != index:
+                    self.children.setdefault(parent, []).append(index)
+                    self.child_names.setdefault(key, index)
+                if node.parent < 0:
+                    node.parent = parent
+            return node
+
+    def get(self, file_id):
+        """The node for file_id, or None if it has not been seen (placeholders included)."""
+        index = self.by_id.get(file_id)
+        if index is None or self.nodes[index].name is None:
+            return None
+        return self.nodes[index]
+
+    def parent_id(self, file_id):
+        index = self.by_id.get(file_id)
+        if index is None or self.nodes[index].parent < 0:
+            return None
+        return self.nodes[self.nodes[index].parent].id
+
+    def children_of(self, folder_id, mime_type=None):
+        index = self.by_id.get(folder_id)
+        children = [self.nodes[i] for i in self.children.get(index, [])]
+        if mime_type is not None:
+            children = [node for node in children if node.mime_type == mime_type]
+        return children
+
+    def find_child(self, folder_id, name):
+        index = self.by_id.get(folder_id)
+        if index is None:
+            return None
+        child = self.child_names.get((index, name))
+        return self.nodes[child] if child is not None else None
+
+    def set_path(self, file_id, path, base_id='root'):
+        """Index file_id as path below base_id; '' makes file_id a base of its own."""
+        with self.lock:
+            index = self._index_of(file_id)
+            key = (self._index_of(base_id), path)
+            self.paths[key] = index
+            self.path_keys[index] = key
+
+    def set_child_path(self, folder_id, child_id, name):
+        """Index child_id as name below folder_id's path, relative to the same base."""
+        with self.lock:
+            parent = self._index_of(folder_id)
+            base, path = self.path_keys.get(parent, (parent, ''))
+            index = self._index_of(child_id)
+            key = (base, f"{path}/{name}" if path else name)
+            self.paths[key] = index
+            self.path_keys[index] = key
+
+    def find_path(self, path, base_id='root'):
+        """The node indexed as path below base_id, or None."""
+        base = self.by_id.get(base_id)
+        index = self.paths.get((base, path)) if base is not None else None
+        return self.nodes[index] if index is not None else None
+
+    def path_of(self, file_id):
+        """file_id's indexed path below its base; '' for a base or an unindexed folder."""
+        key = self.path_keys.get(self.by_id.get(file_id))
+        return key[1] if key else ''
+
+    def is_listed(self, folder_id):
+        return self.complete or folder_id in self.listed
+
+    def mark_listed(self, folder_id):
+        self.listed.add(folder_id)
+
+def list_folder(service, tree, folder_id, page_size=PAGE_SIZE):
+    """List every child of a folder once and add it to the tree.
+
+    The tree then answers "which docs/subfolders are here" and "does
+    <name>.md already exist" without any further API calls. Folders that
+    are already listed are not listed again.
+    """
+    if tree.is_listed(folder_id):
+        return
+    query = f"'{folder_id}' in parents and trashed = false"
+    for item in iter_drive_files(service, query, "id, name, mimeType, modifiedTime, md5Checksum, parents, shortcutDetails(targetId, targetMimeType)",
+                                 page_size=page_size):
+        tree.add(item, folder_id)
+        # A file with several parents is linked under each of them, with
+        # folder_id (where it was found) as its primary parent
+        for parent_id in item.get('parents', []):
+            if parent_id != folder_id:
+                tree.add(item, parent_id)
+    tree.mark_listed(folder_id)
+
+def build_drive_tree(service, drive_id=None, page_size=PAGE_SIZE, tree=None):
+    """Enumerate every doc, folder and generated output in one paginated query.
+
+    Returns a complete DriveTree, so scan_folder can walk any subtree without
+    listing folders one at a time. drive_id restricts the query to a shared
+    drive; otherwise everything visible to the account is listed.
+    """
+    mime_filter = " or ".join(f"mimeType = '{mime_type}'" for mime_type in TREE_MIME_TYPES)
+    query = f"({mime_filter}) and trashed = false"
+    list_kwargs = {}
+    if drive_id:
+        list_kwargs = {'corpora': 'drive', 'driveId': drive_id}
+
+    if tree is None:
+        tree = DriveTree()
+    count = 0
+    for item in iter_drive_files(service, query, "id, name, mimeType, modifiedTime, md5Checksum, parents, shortcutDetails(targetId, targetMimeType)",
+                                 page_size=page_size, **list_kwargs):
+        count += 1
+        for parent_id in item.get('parents', []):
+            tree.add(item, parent_id)
+    tree.complete = True
+    logging.info(f"Enumerated {count} files across {len(tree.children)} folders")
+    return tree
+
+def upload_file_to_drive(service, file_id, file_name, content, filename_suffix, mime_type, dry_run=False, tree=None, parents=None):
+    """Upload a file to Google Drive in the same folder as the original file.
+
+    An existing output is found in the listed parent folder when there is
+    one, else by searching the folder; if the listed output has since been
+    deleted the folder is searched instead.
+    parents, when already known, saves looking up the doc's parent folder.
+    Returns True on success (including dry run), False on failure.
+    """
+    filename = f"{file_name}.{filename_suffix}"
     try:
+        content_bytes = content if isinstance(content, bytes) else content.encode('utf-8')
+        content_md5 = hashlib.md5(content_bytes).hexdigest()
+
         # Get the parent folder of the original file
-        file_metadata = service.files().get(fileId=file_id, fields='parents').execute()
-        parents = file_metadata.get('parents', [])
+        if parents is None:
+            file_metadata = execute_request(service.files().get(fileId=file_id, fields='parents', supportsAllDrives=True))
+            parents = file_metadata.get('parents', [])
 
         if not parents:
             logging.warning(f"No parent folder found for {file_name}, skipping Drive upload")
             return False
 
         parent_id = parents[0]
-        filename = f"{file_name}.{filename_suffix}"
 
         if dry_run:
             logging.info(f"Would upload {filename} to Google Drive folder {parent_id} (Dry Run)")
             return True
 
         # Check if a file with the same name already exists in the parent folder
-        query = f"name = '{filename}' and '{parent_id}' in parents and trashed = false"
-        results = service.files().list(q=query, fields="files(id, name)").execute()
-        existing_files = results.get('files', [])
+        use_listing = tree is not None and tree.is_listed(parent_id)
+        existing = find_output(service, tree if use_listing else None, parent_id, filename)
+
+        if existing and existing.md5 == content_md5:
+            # Byte-identical output already in Drive, e.g. after a comment-only edit
+            logging.info(f"Skipped upload of {filename}: content unchanged (ID: {existing.id})")
+            record_stat('uploads_skipped_unchanged')
+            return True
+
+        if existing:
+            try:
+                update_output(service, existing, filename, content_bytes, mime_type, content_md5)
+                return True
+            except HttpError as e:
+                if e.resp.status != 404 or not use_listing:
+                    raise
+                logging.info(f"Listed {filename} (ID: {existing.id}) no longer exists, searching its folder")
+                # The listing still has the deleted file, so ask Drive instead
+                existing = find_output(service, None, parent_id, filename)
+                if existing:
+                    update_output(service, existing, filename, content_bytes, mime_type, content_md5)
+                    return True
 
-        # Prepare file metadata
+        # Create new file
         file_metadata = {
             'name': filename,
             'parents': [parent_id],
             'mimeType': mime_type
         }
-
-        # Prepare media body
-        if mime_type == 'application/pdf':
-            media_body = MediaIoBaseUpload(io.BytesIO(content), mimetype=mime_type)
-        else:
-            media_body = MediaIoBaseUpload(io.BytesIO(content.encode('utf-8')), mimetype=mime_type)
-
-        if existing_files:
-            # Update existing file
-            existing_file_id = existing_files[0]['id']
-            updated_file = service.files().update(
-                fileId=existing_file_id,
-                media_body=media_body,
-                fields='id'
-            ).execute()
-            logging.info(f"Updated existing file in Drive: {filename} (ID: {updated_file.get('id')})")
-        else:
-            # Create new file
-            created_file = service.files().create(
-                body=file_metadata,
-                media_body=media_body,
-                fields='id'
-            ).execute()
-            logging.info(f"Created new file in Drive: {filename} (ID: {created_file.get('id')})")
-
+        created_file = execute_request(service.files().create(
+            body=file_metadata,
+            media_body=MediaIoBaseUpload(io.BytesIO(content_bytes), mimetype=mime_type),
+            fields='id',
+            supportsAllDrives=True
+        ), kind='upload')
+        logging.info(f"Created new file in Drive: {filename} (ID: {created_file.get('id')})")
+        if use_listing:
+            tree.add({'id': created_file.get('id'), 'name': filename, 'mimeType': mime_type, 'md5Checksum': content_md5}, parent_id)
         return True
 
     except Exception as e:
         logging.error(f"Failed to upload {filename_suffix} to Drive for {file_name}: {e}")
         return False
 
-def convert_to_markdown(service, file_id, file_name, output_dir, dry_run=False):
+def find_output(service, tree, parent_id, filename):
+    """The output called filename in parent_id, from the listed tree when given, else by a query."""
+    if tree is not None:
+        return tree.find_child(parent_id, filename)
+    query = f"name = '{filename}' and '{parent_id}' in parents and trashed = false"
+    found = next(iter_drive_files(service, query, "id, md5Checksum"), None)
+    return DriveNode.from_item(found) if found else None
+
+def update_output(service, existing, filename, content_bytes, mime_type, content_md5):
+    """Replace the content of an existing output in Drive."""
+    updated_file = execute_request(service.files().update(
+        fileId=existing.id,
+        media_body=MediaIoBaseUpload(io.BytesIO(content_bytes), mimetype=mime_type),
+        fields='id',
+        supportsAllDrives=True
+    ), kind='upload')
+    logging.info(f"Updated existing file in Drive: {filename} (ID: {updated_file.get('id')})")
+    existing.md5 = content_md5
+
+def export_document(service, file_id, mime_type):
+    """Download a Google Doc export into memory and return its bytes."""
+    request = service.files().export_media(fileId=file_id, mimeType=mime_type)
+    fh = io.BytesIO()
+    downloader = MediaIoBaseDownload(fh, request)
+    done = False
+    while done is False:
+        _, done = next_chunk_with_retry(downloader)
+    return fh.getvalue()
+
+def export_on_thread_service(file_id, mime_type):
+    return export_document(get_thread_service(), file_id, mime_type)
+
+def start_export_pool(size):
+    """Create the pool that runs PDF exports alongside the HTML export."""
+    global _export_pool
+    _export_pool = ThreadPoolExecutor(max_workers=size, thread_name_prefix='export')
+
+def shutdown_export_pool():
+    global _export_pool
+    if _export_pool is not None:
+        _export_pool.shutdown(wait=True)
+        _export_pool = None
+
+def html_content_hash(html_content):
+    """Hash an HTML export with Google's volatile ids and anchors removed."""
+    for pattern in VOLATILE_HTML_PATTERNS:
+        html_content = pattern.sub('', html_content)
+    return hashlib.sha256(html_content.encode('utf-8')).hexdigest()
+
+def markdownify_html(html_content):
+    return markdownify.markdownify(html_content, heading_style="ATX")
+
+def unwrap_google_redirect(href):
+    """The target of a google.com/url?q=... link wrapper, or href unchanged."""
+    parsed = urllib.parse.urlsplit(href)
+    if parsed.netloc.endswith('google.com') and parsed.path == '/url':
+        target = urllib.parse.parse_qs(parsed.query).get('q')
+        if target:
+            return target[0]
+    return href
+
+def css_emphasis(declarations):
+    """The emphasis ('bold', 'italic', 'strike') a CSS declaration block applies."""
+    emphasis = set()
+    for declaration in declarations.split(';'):
+        prop, _, value = declaration.partition(':')
+        prop, value = prop.strip().lower(), value.strip().lower()
+        if prop == 'font-weight' and (value in ('bold', 'bolder') or (value.isdigit() and int(value) >= 600)):
+            emphasis.add('bold')
+        elif prop == 'font-style' and value == 'italic':
+            emphasis.add('italic')
+        elif prop == 'text-decoration' and 'line-through' in value:
+            emphasis.add('strike')
+    return emphasis
+
+class DocsMarkdownParser(HTMLParser):
+    """Event-driven converter from Google Docs HTML exports to markdown.
+
+    No DOM is built: only the block being assembled is held, and every
+    finished paragraph, heading, list item or table row is passed to write()
+    at once, so memory is bounded by the largest block, not the document.
+    Emphasis comes from the classes defined in the export's <style> block,
+    list nesting from Google's lst-kix_<id>-<level> classes, and links are
+    unwrapped from their google.com/url?q= redirects.
+    """
+
+    BLOCK_TAGS = {'p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'li'}
+    INLINE_TAGS = {'span', 'a', 'b', 'strong', 'i', 'em', 's', 'del', 'sup', 'sub', 'u'}
+    SKIPPED_TAGS = {'title', 'script'}
+    TAG_EMPHASIS = {'b': 'bold', 'strong': 'bold', 'i': 'italic', 'em': 'italic', 's': 'strike', 'del': 'strike'}
+
+    def __init__(self, write):
+        super().__init__(convert_charrefs=True)
+        self.write = write
+        self.class_emphasis = {}
+        self.style_parts = []
+        self.in_style = False
+        self.skip = 0
+        self.lists = []
+        self.block = None
+        self.list_item = None
+        self.frames = []
+        self.row = None
+        self.table_rows = 0
+        self.previous = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag in self.SKIPPED_TAGS:
+            self.skip += 1
+        elif tag == 'style':
+            self.in_style = True
+        elif self.skip:
+            return
+        elif tag in ('ul', 'ol'):
+            level = DOCS_LIST_LEVEL.search(attrs.get('class') or '')
+            self.lists.append((tag == 'ol', int(level.group(1)) if level else len(self.lists)))
+        elif tag == 'table':
+            self.end_block()
+            self.table_rows = 0
+        elif tag == 'tr':
+            self.row = []
+        elif tag in ('td', 'th'):
+            self.start_block('cell')
+        elif tag in self.BLOCK_TAGS:
+            if tag == 'p' and self.block in ('li', 'cell'):
+                # Paragraphs inside list items and cells become line breaks
+                if self.frames[0][2]:
+                    self.frames[-1][2].append('\n')
+                return
+            self.start_block(tag)
+        elif tag == 'br':
+            self.ensure_block()
+            self.frames[-1][2].append('\n')
+        elif tag == 'hr':
+            self.end_block()
+            self.emit('---', 'hr')
+        elif tag == 'img':
+            self.ensure_block()
+            self.frames[-1][2].append(f"![{attrs.get('alt') or ''}]({attrs.get('src') or ''})")
+        elif tag in self.INLINE_TAGS:
+            emphasis = set()
+            if tag in self.TAG_EMPHASIS:
+                emphasis.add(self.TAG_EMPHASIS[tag])
+            for name in (attrs.get('class') or '').split():
+                emphasis |= self.class_emphasis.get(name, set())
+            emphasis |= css_emphasis(attrs.get('style') or '')
+            href = unwrap_google_redirect(attrs['href']) if tag == 'a' and attrs.get('href') else None
+            self.ensure_block()
+            self.frames.append((emphasis_marker(emphasis), href, []))
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIPPED_TAGS:
+            self.skip = max(0, self.skip - 1)
+        elif tag == 'style':
+            self.in_style = False
+            for name, declarations in DOCS_STYLE_RULE.findall(''.join(self.style_parts)):
+                emphasis = css_emphasis(declarations)
+                if emphasis:
+                    self.class_emphasis[name] = emphasis
+            self.style_parts = []
+        elif self.skip:
+            return
+        elif tag in ('ul', 'ol'):
+            if self.lists:
+                self.lists.pop()
+        elif tag in ('td', 'th'):
+            if self.block == 'cell':
+                self.row.append(self.block_text(line_break='<br>').replace('|', '\\|'))
+                self.block = None
+        elif tag == 'tr':
+            if self.row:
+                line = '| ' + ' | '.join(self.row) + ' |'
+                if self.table_rows == 0:
+                    # Markdown tables need a header; the first row serves as one
+                    line += '\n| ' + ' | '.join('---' for _ in self.row) + ' |'
+                self.emit(line, 'row')
+                self.table_rows += 1
+            self.row = None
+        elif tag == self.block:
+            self.end_block()
+        elif tag in self.INLINE_TAGS and len(self.frames) > 1:
+            self.close_frame()
+
+    def handle_data(self, data):
+        if self.in_style:
+            self.style_parts.append(data)
+            return
+        if self.skip:
+            return
+        text = re.sub(r'\s+', ' ', data.replace('\xa0', ' '))
+        if self.block is None:
+            if not text.strip():
+                return
+            self.start_block('p')
+        self.frames[-1][2].append(text.replace('*', r'\*').replace('_', r'\_'))
+
+    def close(self):
+        super().close()
+        self.end_block()
+
+    def start_block(self, kind):
+        self.end_block()
+        self.block = kind
+        self.list_item = self.lists[-1] if kind == 'li' and self.lists else (False, 0)
+        self.frames = [('', None, [])]
+
+    def ensure_block(self):
+        if self.block is None:
+            self.start_block('p')
+
+    def close_frame(self):
+        marker, href, parts = self.frames.pop()
+        text = ''.join(parts)
+        core = text.strip()
+        if core:
+            if href and not href.startswith('#'):
+                core = f"[{core}]({href})"
+            lead = text[:len(text) - len(text.lstrip())]
+            trail = text[len(text.rstrip()):]
+            text = f"{lead}{marker}{core}{marker[::-1]}{trail}"
+        self.frames[-1][2].append(text)
+
+    def block_text(self, line_break='  \n'):
+        while len(self.frames) > 1:
+            self.close_frame()
+        lines = [re.sub(' +', ' ', line).strip() for line in ''.join(self.frames[0][2]).split('\n')]
+        self.frames = []
+        return line_break.join(lines).strip()
+
+    def end_block(self):
+        if self.block is None:
+            return
+        kind = self.block
+        if kind == 'cell':
+            # A cell left open by the markup joins the row as-is
+            if self.row is not None:
+                self.row.append(self.block_text(line_break='<br>'))
+            self.block = None
+            return
+        text = self.block_text()
+        self.block = None
+        if not text:
+            return
+        if kind == 'li':
+            ordered, level = self.list_item
+            indent = '    ' * level
+            text = indent + ('1. ' if ordered else '- ') + text.replace('\n', '\n' + indent + '    ')
+        elif kind.startswith('h'):
+            text = '#' * int(kind[1]) + ' ' + text
+            kind = 'heading'
+        self.emit(text, kind)
+
+    def emit(self, text, kind):
+        if self.previous is not None:
+            # List items and table rows are single-spaced; everything else gets a blank line
+            self.write('\n' if kind == self.previous and kind in ('li', 'row') else '\n\n')
+        self.write(text)
+        self.previous = kind
+
+def emphasis_marker(emphasis):
+    marker = '~~' if 'strike' in emphasis else ''
+    if 'bold' in emphasis:
+        marker += '**'
+    if 'italic' in emphasis:
+        marker += '*'
+    return marker
+
+def streaming_markdown(html_content):
+    """Convert a Google Docs HTML export with DocsMarkdownParser, feeding it in chunks."""
+    out = io.StringIO()
+    parser = DocsMarkdownParser(out.write)
+    for start in range(0, len(html_content), STREAM_CHUNK_SIZE):
+        parser.feed(html_content[start:start + STREAM_CHUNK_SIZE])
+    parser.close()
+    return out.getvalue()
+
+# Converters that turn a Google Docs HTML export into markdown
+HTML_CONVERTERS = {
+    'markdownify': markdownify_html,
+    'streaming': streaming_markdown,
+}
+CONVERTERS = ['native', *HTML_CONVERTERS]
+
+def export_for_conversion(service, file_id, file_name, converter, fallback=True):
+    """Export a doc in the format its converter starts from.
+
+    Returns (converter used, exported text, content hash). 'native' asks
+    Drive for text/markdown; if Drive refuses that export and fallback is
+    set, the HTML export is used with FALLBACK_CONVERTER instead.
+    """
+    if converter == 'native':
+        try:
+            md_content = export_document(service, file_id, 'text/markdown').decode('utf-8')
+            return converter, md_content, hashlib.sha256(md_content.encode('utf-8')).hexdigest()
+        except HttpError as e:
+            if not fallback:
+                raise
+            logging.warning(f"Native markdown export of {file_name} failed ({e}), falling back to {FALLBACK_CONVERTER}")
+            record_stat('native_export_fallbacks')
+            converter = FALLBACK_CONVERTER
+    html_content = export_document(service, file_id, 'text/html').decode('utf-8')
+    return converter, html_content, html_content_hash(html_content)
+
+class ConversionTimeout(Exception):
+    """A document took longer than the per-task limit to convert."""
+
+def warm_conversion_worker():
+    """Pool initializer: import the converters and run each once, so the first real doc pays no start-up cost."""
+    for convert in HTML_CONVERTERS.values():
+        convert('<p>warm</p>')
+
+def convert_in_worker(converter, payload):
+    """Run an HTML converter in a pool worker.
+
+    payload is the UTF-8 HTML itself, or (shared memory name, size) for
+    exports large enough to be handed over through shared memory.
+    """
+    if isinstance(payload, tuple):
+        name, size = payload
+        block = shared_memory.SharedMemory(name=name)
+        try:
+            html_content = bytes(block.buf[:size]).decode('utf-8')
+        finally:
+            block.close()
+    else:
+        html_content = payload.decode('utf-8')
+    return HTML_CONVERTERS[converter](html_content)
+
+class ConversionPool:
+    """Pre-warmed worker processes that run the CPU-bound HTML converters.
+
+    Conversions run outside the GIL, so several worker threads can convert
+    at once on a multi-core host. A task that runs past timeout seconds has
+    its pool terminated and replaced; tasks that were in flight on the
+    terminated pool are resubmitted once to the new one.
+    """
+
+    def __init__(self, size, timeout=CONVERT_TIMEOUT):
+        self.size = size
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.pool = self._start()
+
+    def _start(self):
+        # spawn: the parent runs threads, which fork does not mix well with
+        return multiprocessing.get_context('spawn').Pool(self.size, initializer=warm_conversion_worker)
+
+    def _replace(self, pool):
+        with self.lock:
+            if self.pool is pool:
+                pool.terminate()
+                self.pool = self._start()
+
+    def convert(self, converter, html_content):
+        data = html_content.encode('utf-8')
+        block = None
+        if len(data) >= SHARED_MEMORY_THRESHOLD:
+            # Large exports skip the pool's task pipe, which every submission shares
+            block = shared_memory.SharedMemory(create=True, size=len(data))
+            block.buf[:len(data)] = data
+            payload = (block.name, len(data))
+        else:
+            payload = data
+        try:
+            for _ in range(2):
+                # Submit under the lock so _replace() cannot terminate the
+                # pool between reading it and queueing the task
+                with self.lock:
+                    pool = self.pool
+                    result = pool.apply_async(convert_in_worker, (converter, payload))
+                deadline = time.monotonic() + self.timeout
+                while not result.ready() and self.pool is pool:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._replace(pool)
+                        record_stat('conversions_timed_out')
+                        raise ConversionTimeout(f"conversion took longer than {self.timeout}s")
+                    result.wait(min(remaining, CONVERT_POLL_INTERVAL))
+                if result.ready():
+                    return result.get()
+                # Another task's timeout replaced the pool under this one
+            raise ConversionTimeout("conversion pool was restarted twice while this doc was queued")
+        finally:
+            if block is not None:
+                block.close()
+                block.unlink()
+
+    def close(self):
+        with self.lock:
+            self.pool.close()
+            self.pool.join()
+
+def start_convert_pool(size, timeout=CONVERT_TIMEOUT):
+    """Create the process pool render_markdown hands HTML conversions to."""
+    global _convert_pool
+    _convert_pool = ConversionPool(size, timeout=timeout)
+
+def shutdown_convert_pool():
+    global _convert_pool
+    if _convert_pool is not None:
+        _convert_pool.close()
+        _convert_pool = None
+
+def render_markdown(converter, exported):
+    """Markdown for text returned by export_for_conversion."""
+    if converter == 'native':
+        return exported
+    if _convert_pool is not None:
+        return _convert_pool.convert(converter, exported)
+    return HTML_CONVERTERS[converter](exported)
+
+def export_and_probe(service, file_id, file_name, converter, previous_hash, pdf_exports):
+    """Export a doc for its converter, using the export as a probe when previous_hash is given.
+
+    The PDF export is handed to pdf_exports (if there is a pool) so it
+    downloads alongside: right away without a probe, once the probe shows a
+    change otherwise.
+    Returns None if the content is unchanged, else (converter used,
+    exported text, content hash, PDF future or None).
+    """
+    pdf_future = None
+    if previous_hash is None and pdf_exports is not None:
+        pdf_future = pdf_exports.submit(export_on_thread_service, file_id, 'application/pdf')
+
+    converter, exported, content_hash = export_for_conversion(service, file_id, file_name, converter)
+
+    if previous_hash is not None and content_hash == previous_hash:
+        logging.info(f"File {file_name} content unchanged since last conversion, skipping PDF export and uploads")
+        record_stat('docs_unchanged_by_probe')
+        return None
+
+    if pdf_future is None and pdf_exports is not None:
+        # Content changed: overlap the PDF download with the conversion
+        pdf_future = pdf_exports.submit(export_on_thread_service, file_id, 'application/pdf')
+    return converter, exported, content_hash, pdf_future
+
+def convert_to_markdown(service, file_id, file_name, output_dir, dry_run=False, tree=None, previous_hash=None, parents=None, converter=None):
+    """Export a doc as markdown and PDF and upload both next to it.
+
+    When previous_hash is given the markdown (or HTML) export doubles as a
+    probe: if its hash still matches, the PDF export and both uploads are
+    skipped. converter defaults to the one selected for the run.
+    Returns {'content_hash', 'unchanged'} on success, False on failure.
+    """
+    converter = converter or _converter
     try:
         if dry_run:
             # Simulate conversion
             logging.info(f"Would convert {file_name} to markdown and PDF (Dry Run)")
-            upload_file_to_drive(service, file_id, file_name, "", "md", "text/markdown", dry_run=True)
-            upload_file_to_drive(service, file_id, file_name, b"", "pdf", "application/pdf", dry_run=True)
-            return True
+            upload_file_to_drive(service, file_id, file_name, "", "md", "text/markdown", dry_run=True, tree=tree, parents=parents)
+            upload_file_to_drive(service, file_id, file_name, b"", "pdf", "application/pdf", dry_run=True, tree=tree, parents=parents)
+            return {'content_hash': None, 'unchanged': False}
 
-        # Export Google Doc as HTML
-        request = service.files().export_media(fileId=file_id, mimeType='text/html')
-        fh = io.BytesIO()
-        downloader = MediaIoBaseDownload(fh, request)
-        done = False
-        while done is False:
-            _, done = downloader.next_chunk()
+        # Export Google Doc as markdown, or as HTML for a local converter
+        probed = export_and_probe(service, file_id, file_name, converter, previous_hash, _export_pool)
+        if probed is None:
+            return {'content_hash': previous_hash, 'unchanged': True}
+        converter, exported, content_hash, pdf_future = probed
 
-        html_content = fh.getvalue().decode('utf-8')
-        md_content = markdownify.mdownify(html_content, heading_style="ATX")
+        md_content = render_markdown(converter, exported)
 
         # Export Google Doc as PDF
-        request_pdf = service.files().export_media(fileId=file_id, mimeType='application/pdf')
-        fh_pdf = io.BytesIO()
-        downloader_pdf = MediaIoBaseDownload(fh_pdf, request_pdf)
-        done_pdf = False
-        while done_pdf is False:
-            _, done_pdf = downloader_pdf.next_chunk()
-
-        pdf_content = fh_pdf.getvalue()
-
-        # Sanitize filename for local fallback
-        safe_filename = "".join([c for c in file_name if c.isalpha() or c.isdigit() or c in (' ', '-', '_')]).strip()
-        output_path = os.path.join(output_dir, f"{safe_filename}.md")
-        pdf_path = os.path.join(output_dir, f"{safe_filename}.pdf")
-
-        # Upload both files to Google Drive
-        md_uploaded = upload_file_to_drive(service, file_id, file_name, md_content, "md", "text/markdown", dry_run=dry_run)
-        pdf_uploaded = upload_file_to_drive(service, file_id, file_name, pdf_content, "pdf", "application/pdf", dry_run=dry_run)
-
-        # Only save locally if upload failed
-        if not md_uploaded:
-            logging.warning(f"Markdown upload failed, saving locally to {output_path}")
-            os.makedirs(output_dir, exist_ok=True)
-            with open(output_path, 'w') as f:
-                f.write(md_content)
-
-        if not pdf_uploaded:
-            logging.warning(f"PDF upload failed, saving locally to {pdf_path}")
-            os.makedirs(output_dir, exist_ok=True)
-            with open(pdf_path, 'wb') as f:
-                f.write(pdf_content)
-
-        if md_uploaded and pdf_uploaded:
-            logging.info(f"Successfully uploaded {file_name} markdown and PDF to Google Drive")
+        if pdf_future is not None:
+            pdf_content = pdf_future.result()
         else:
-            logging.info(f"Converted {file_name} (some files saved locally due to upload failures)")
+            pdf_content = export_document(service, file_id, 'application/pdf')
 
-        return True
+        upload_outputs(service, file_id, file_name, output_dir, md_content, pdf_content, tree=tree, parents=parents)
+        return {'content_hash': content_hash, 'unchanged': False}
     except Exception as e:
         logging.error(f"Failed to convert {file_name}: {e}")
         return False
 
-def resolve_path_to_id(service, path):
-    if not path or path == '/':
-        return 'root'
-    
-    parts = [p for p in path.split('/') if p]
-    parent_id = 'root'
-    
-    for part in parts:
-        query = f"name = '{part}' and '{parent_id}' in parents and mimeType = 'application/vnd.google-apps.folder' and trashed = false"
-        results = service.files().list(q=query, fields="files(id, name)").execute()
-        files = results.get('files', [])
-        
-        if not files:
-            logging.error(f"Folder '{part}' not found in path '{path}'")
-            return None
-        
-        if len(files) > 1:
-            logging.warning(f"Multiple folders named '{part}' found. Using the first one ({files[0]['id']}).")
-        
-        parent_id = files[0]['id']
-        
-    return parent_id
+def upload_outputs(service, file_id, file_name, output_dir, md_content, pdf_content, tree=None, parents=None):
+    """Upload a doc's markdown and PDF next to it, saving locally whatever fails to upload."""
+    # Sanitize filename for local fallback
+    safe_filename = sanitize_name(file_name)
+    output_path = os.path.join(output_dir, f"{safe_filename}.md")
+    pdf_path = os.path.join(output_dir, f"{safe_filename}.pdf")
+
+    # Upload both files to Google Drive
+    md_uploaded = upload_file_to_drive(service, file_id, file_name, md_content, "md", "text/markdown",
+                                       tree=tree, parents=parents)
+    pdf_uploaded = upload_file_to_drive(service, file_id, file_name, pdf_content, "pdf", "application/pdf",
+                                        tree=tree, parents=parents)
+
+    # Only save locally if upload failed
+    if not md_uploaded:
+        logging.warning(f"Markdown upload failed, saving locally to {output_path}")
+        os.makedirs(output_dir, exist_ok=True)
+        with open(output_path, 'w') as f:
+            f.write(md_content)
+
+    if not pdf_uploaded:
+        logging.warning(f"PDF upload failed, saving locally to {pdf_path}")
+        os.makedirs(output_dir, exist_ok=True)
+        with open(pdf_path, 'wb') as f:
+            f.write(pdf_content)
+
+    if md_uploaded and pdf_uploaded:
+        logging.info(f"Successfully uploaded {file_name} markdown and PDF to Google Drive")
+    else:
+        logging.info(f"Converted {file_name} (some files saved locally due to upload failures)")
+        record_failure(file_id)
+
+def find_child_folder(service, parent_id, name, page_size=PAGE_SIZE):
+    """ID of the folder called name inside parent_id, or None if there is none."""
+    query = f"name = '{name}' and '{parent_id}' in parents and mimeType = '{FOLDER_MIME_TYPE}' and trashed = false"
+    # Two matches are enough to know the name is ambiguous
+    files = list(itertools.islice(iter_drive_files(service, query, "id", page_size=page_size), 2))
+    if len(files) > 1:
+        logging.warning(f"Multiple folders named '{name}' found. Using the first one ({files[0]['id']}).")
+    return files[0]['id'] if files else None
+
+def lookup_child_folder(service, parent_id, name, page_size=PAGE_SIZE, tree=None):
+    """find_child_folder, answered from the tree when it already holds the folder and recorded in it otherwise."""
+    known = tree.find_child(parent_id, name) if tree is not None else None
+    if known is not None and known.mime_type == FOLDER_MIME_TYPE:
+        return known.id
+    folder_id = find_child_folder(service, parent_id, name, page_size=page_size)
+    if folder_id and tree is not None:
+        tree.add({'id': folder_id, 'name': name, 'mimeType': FOLDER_MIME_TYPE}, parent_id)
+    return folder_id
+
+def resolve_paths(service, paths, page_size=PAGE_SIZE, tree=None, path_cache=None, workers=1):
+    """Resolve several config paths together, one path depth at a time.
+
+    At each depth the distinct prefixes that are not cached yet are looked
+    up in parallel on up to `workers` threads, so a prefix shared by several
+    paths is looked up once and a slow path does not hold up the others.
+    Resolved segments are added to path_cache. Returns {path: folder ID or
+    None}.
+    """
+    if path_cache is None:
+        path_cache = {'id': 'root', 'children': {}}
+    split = {path: [p for p in path.split('/') if p] for path in paths}
+    lookup_service = service if workers <= 1 else None
+    not_found = set()
+
+    def walk(parts):
+        entry = path_cache
+        for part in parts:
+            entry = entry['children'].get(part)
+            if entry is None:
+                return None
+        return entry
+
+    def lookup(key):
+        parent_id, name = key
+        return lookup_child_folder(lookup_service or get_thread_service(), parent_id, name, page_size=page_size, tree=tree)
+
+    depth = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='resolve') as pool:
+        while any(depth < len(parts) for parts in split.values()):
+            pending = {}
+            for parts in split.values():
+                if depth >= len(parts):
+                    continue
+                parent = walk(parts[:depth])
+                if parent is not None and parts[depth] not in parent['children']:
+                    indexed = tree.find_path('/'.join(parts[:depth + 1])) if tree is not None else None
+                    if indexed is not None:
+                        parent['children'][parts[depth]] = {'id': indexed.id, 'children': {}}
+                        continue
+                    key = (parent['id'], parts[depth])
+                    if key not in not_found:
+                        pending.setdefault(key, parent)
+            for key, folder_id in zip(pending, pool.map(lookup, pending)):
+                if folder_id:
+                    pending[key]['children'][key[1]] = {'id': folder_id, 'children': {}}
+                else:
+                    not_found.add(key)
+            depth += 1
+
+    resolved = {}
+    for path, parts in split.items():
+        parent_id = 'root'
+        entry = path_cache
+        for depth, part in enumerate(parts):
+            entry = entry['children'].get(part)
+            if entry is None:
+                logging.error(f"Folder '{part}' not found in path '{path}'")
+                parent_id = None
+                break
+            if tree is not None:
+                tree.add({'id': entry['id'], 'name': part, 'mimeType': FOLDER_MIME_TYPE}, parent_id)
+                tree.set_path(entry['id'], '/'.join(parts[:depth + 1]))
+            parent_id = entry['id']
+        resolved[path] = parent_id
+    return resolved
+
+def resolve_path_to_id(service, path, page_size=PAGE_SIZE, tree=None, path_cache=None):
+    """Resolve a single 'My/Drive/Path' to a folder ID; see resolve_paths."""
+    return resolve_paths(service, [path], page_size=page_size, tree=tree, path_cache=path_cache)[path]
+
+def load_path_cache(state):
+    return state.get(PATH_CACHE_KEY) or {'id': 'root', 'children': {}}
+
+def validate_path_cache(service, path_cache, paths):
+    """Drop cached segments of paths whose folder was renamed, moved or trashed.
+
+    Every cached ID along the given paths is checked with one batched get.
+    An entry that fails the check is removed together with everything below
+    it, so resolve_paths only re-resolves that part of the path.
+    """
+    checks = []
+    seen = set()
+    for path in paths:
+        parent = path_cache
+        for part in [p for p in path.split('/') if p]:
+            entry = parent['children'].get(part)
+            if entry is None:
+                break
+            if id(entry) not in seen:
+                seen.add(id(entry))
+                checks.append((parent, part, entry))
+            parent = entry
+    if not checks:
+        return
+
+    # 'root' rides along to learn the real ID behind the alias
+    fetched = batch_get_files(service, ['root'] + [entry['id'] for _, _, entry in checks], 'id, name, parents, trashed')
+    real_root_id = fetched.get('root', {}).get('id', 'root')
+    dropped = set()
+    for parent, name, entry in checks:
+        metadata = fetched.get(entry['id'])
+        parent_id = real_root_id if parent['id'] == 'root' else parent['id']
+        if (id(parent) in dropped or not metadata or metadata.get('trashed') or metadata.get('name') != name
+                or parent_id not in metadata.get('parents', [])):
+            dropped.add(id(entry))
+            parent['children'].pop(name, None)
+    if dropped:
+        logging.info(f"{len(dropped)} cached folder path segment(s) no longer valid, re-resolving")
+
+def process_document(service, node, folder_id, tree, local_dir, state, dry_run=False, converted_files=None, pipeline=None, parents=None):
+    """Convert a listed doc if it changed since the last run or its outputs are missing.
+
+    With a pipeline the conversion is queued onto its stages instead of
+    running inline.
+    """
+    plan = plan_conversion(node, folder_id, tree, state)
+    if plan is not None:
+        plan['parents'] = parents
+        plan['folder_id'] = folder_id
+        dispatch_conversion(service, node, plan, tree, local_dir, state, dry_run=dry_run,
+                            converted_files=converted_files, pipeline=pipeline)
+
+def plan_conversion(node, folder_id, tree, state):
+    """Decide whether a doc listed in folder_id needs converting.
+
+    Returns None to skip it, otherwise {'previous_hash', 'parents'} for
+    convert_to_markdown.
+    """
+    file_name = node.name
+    modified_time = node.modified_time
+
+    # Check if changed
+    record = state.get(node.id)
+    last_recorded_time = recorded_modified_time(record)
+
+    # Check if markdown and PDF files exist in Drive
+    md_exists = tree.find_child(folder_id, f"{file_name}.md") is not None
+    pdf_exists = tree.find_child(folder_id, f"{file_name}.pdf") is not None
+    need_conversion = False
+
+    if not md_exists or not pdf_exists:
+        logging.info(f"File {file_name} outputs missing (md: {md_exists}, pdf: {pdf_exists}). Converting...")
+        need_conversion = True
+
+    if last_recorded_time != modified_time or need_conversion:
+        if not need_conversion:
+            logging.info(f"File {file_name} changed (new: {modified_time}, old: {last_recorded_time}). Converting...")
+        # With both outputs present the stored content hash lets the HTML
+        # export decide whether anything actually needs regenerating.
+        return {
+            'previous_hash': record.get('contentHash') if isinstance(record, dict) and not need_conversion else None,
+            'parents': None,
+        }
+    logging.info(f"File {file_name} unchanged and outputs exist.")
+    return None
+
+def dispatch_conversion(service, node, plan, tree, local_dir, state, dry_run=False, converted_files=None, pipeline=None):
+    job = dict(plan, node=node, tree=tree, local_dir=local_dir, state=state, dry_run=dry_run,
+               converted_files=converted_files)
+    if pipeline is not None and not dry_run:
+        pipeline.submit(job)
+    else:
+        convert_and_record(service, job)
+
+def recorded_modified_time(record):
+    """modifiedTime from a state record; older state stores it as a bare string."""
+    if isinstance(record, dict):
+        return record.get('modifiedTime')
+    return record
+
+def convert_and_record(service, job):
+    """Convert the doc of a job from dispatch_conversion, then record it in state and the report."""
+    node = job['node']
+    try:
+        result = convert_to_markdown(service, node.id, node.name, job['local_dir'], dry_run=job['dry_run'],
+                                     tree=job['tree'], previous_hash=job['previous_hash'], parents=job['parents'])
+        if result:
+            record_conversion(job, result)
+        else:
+            record_failure(node.id)
+    except Exception as e:
+        logging.error(f"Failed to convert {node.name}: {e}")
+        record_failure(node.id)
+
+def record_conversion(job, result):
+    """Store a conversion result in state and, unless nothing changed, in the report."""
+    node = job['node']
+    with STATE_LOCK:
+        if not job['dry_run']:
+            job['state'][node.id] = {
+                'modifiedTime': node.modified_time,
+                'contentHash': result['content_hash'],
+            }
+            save_state(job['state'])
+        if result['unchanged']:
+            return
+        if job['converted_files'] is not None:
+            # Store as tuple: (folder_path, filename)
+            folder_path = job['tree'].path_of(job['folder_id'])
+            display_path = f"{folder_path}/{node.name}" if folder_path else node.name
+            job['converted_files'].append((display_path, node.name))
+
+class ConversionPipeline:
+    """Export, convert and upload stages joined by bounded queues.
+
+    Listing hands jobs from dispatch_conversion to submit(). Export workers
+    run export_and_probe, as convert_to_markdown does, with a PDF pool of
+    their own size so the PDF download overlaps the markdown export and
+    conversion. Converter threads turn the export into markdown
+    (through the process pool when one is running) and uploaders wait for
+    the PDF, write both outputs and record the result. Every stage has its
+    own thread count, and because the queues between stages are bounded, a
+    fast lister blocks in submit() instead of piling exports up in memory.
+    """
+
+    def __init__(self, export_workers, convert_workers, upload_workers, queue_size):
+        self.exports = queue.Queue(maxsize=queue_size)
+        self.conversions = queue.Queue(maxsize=queue_size)
+        self.uploads = queue.Queue(maxsize=queue_size)
+        self.pdf_exports = ThreadPoolExecutor(max_workers=export_workers, thread_name_prefix='pipeline-pdf')
+        self.stages = [
+            (self.exports, self._start('export', export_workers, self.exports, self._export)),
+            (self.conversions, self._start('markdown', convert_workers, self.conversions, self._convert)),
+            (self.uploads, self._start('upload', upload_workers, self.uploads, self._upload)),
+        ]
+
+    def _start(self, name, count, inbox, handle):
+        threads = [threading.Thread(target=self._work, args=(inbox, handle), name=f"pipeline-{name}-{i}", daemon=True)
+                   for i in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def _work(self, inbox, handle):
+        while True:
+            job = inbox.get()
+            if job is None:
+                return
+            try:
+                handle(job)
+            except Exception as e:
+                logging.error(f"Failed to convert {job['node'].name}: {e}")
+                record_failure(job['node'].id)
+
+    def submit(self, job):
+        """Queue a doc for export; blocks while the export stage is full."""
+        self.exports.put(job)
+
+    def close(self):
+        """Let every submitted doc drain through all stages, then stop the threads."""
+        for inbox, threads in self.stages:
+            for _ in threads:
+                inbox.put(None)
+            for thread in threads:
+                thread.join()
+        self.pdf_exports.shutdown(wait=True)
+
+    def _export(self, job):
+        service = get_thread_service()
+        node = job['node']
+        probed = export_and_probe(service, node.id, node.name, _converter, job['previous_hash'], self.pdf_exports)
+        if probed is None:
+            record_conversion(job, {'content_hash': job['previous_hash'], 'unchanged': True})
+            return
+        converter, exported, content_hash, pdf_future = probed
+        job.update(converter=converter, exported=exported, content_hash=content_hash, pdf_future=pdf_future)
+        self.conversions.put(job)
+
+    def _convert(self, job):
+        job['md_content'] = render_markdown(job.pop('converter'), job.pop('exported'))
+        self.uploads.put(job)
+
+    def _upload(self, job):
+        node = job['node']
+        pdf_content = job.pop('pdf_future').result()
+        upload_outputs(get_thread_service(), node.id, node.name, job['local_dir'], job.pop('md_content'),
+                       pdf_content, tree=job['tree'], parents=job['parents'])
+        record_conversion(job, {'content_hash': job['content_hash'], 'unchanged': False})
+
+def scan_folder(service, folder_id, local_dir, state, dry_run=False, converted_files=None, page_size=PAGE_SIZE, pipeline=None,
+                tree=None, listers=1, visited=None):
+    """Convert changed docs under folder_id and in every folder below it."""
+    scan_folders(service, [(folder_id, local_dir)], state, dry_run=dry_run, converted_files=converted_files,
+                 page_size=page_size, pipeline=pipeline, tree=tree, listers=listers, visited=visited)
 
-def scan_folder(service, folder_id, local_dir, state, dry_run=False, converted_files=None, folder_path=""):
+def scan_folders(service, seeds, state, dry_run=False, converted_files=None, page_size=PAGE_SIZE, pipeline=None,
+                 tree=None, listers=1, visited=None):
+    """Convert changed docs under every (folder_id, local_dir) seed.
+
+    Folders are crawled breadth-first from one work queue: `listers` threads
+    (or the calling thread when it is 1) take a folder, list it, hand its
+    docs to the conversion path and queue its subfolders, including folders
+    reached through shortcuts. A folder already in visited is never queued
+    again, so folders with several parents and shortcut cycles are scanned
+    once. All seeds are queued before the crawl starts, so a seed that lies
+    inside another one is scanned once, as its own seed. Folder contents
+    come from tree when it already holds them, and every queued folder's
+    path below its seed goes into tree's path index.
+    """
+    if tree is None:
+        tree = DriveTree()
+    if visited is None:
+        visited = set()
+    work = queue.Queue()
+
+    def enqueue(sub_folder_id, sub_local_dir, parent_id=None, name=None):
+        with VISITED_LOCK:
+            if sub_folder_id in visited:
+                logging.info(f"Folder {name or sub_folder_id} ({sub_folder_id}) already scanned, skipping")
+                return
+            visited.add(sub_folder_id)
+            # Only the path the folder is scanned under is indexed
+            if parent_id is None:
+                tree.set_path(sub_folder_id, '', base_id=sub_folder_id)
+            else:
+                tree.set_child_path(parent_id, sub_folder_id, name)
+        work.put((sub_folder_id, sub_local_dir))
+
+    def crawl(lister_service):
+        while True:
+            item = work.get()
+            if item is None:
+                return
+            try:
+                for subfolder in scan_one_folder(lister_service or get_thread_service(), *item, state, dry_run=dry_run,
+                                                 converted_files=converted_files, page_size=page_size,
+                                                 pipeline=pipeline, tree=tree):
+                    enqueue(*subfolder)
+            finally:
+                work.task_done()
+            if lister_service is not None and work.empty():
+                return
+
+    for seed in seeds:
+        enqueue(*seed)
+    if listers <= 1:
+        if not work.empty():
+            crawl(service)
+        return
+
+    threads = [threading.Thread(target=crawl, args=(None,), name=f"lister-{i}", daemon=True) for i in range(listers)]
+    for thread in threads:
+        thread.start()
+    work.join()
+    for _ in threads:
+        work.put(None)
+    for thread in threads:
+        thread.join()
+
+def get_my_drive_id(service):
+    """Real ID of the user's My Drive; listings report it in parents, never the 'root' alias."""
+    return execute_request(service.files().get(fileId='root', fields='id', supportsAllDrives=True))['id']
+
+def find_nested_roots(service, roots, tree, my_drive_id=None):
+    """Return (inner, outer) pairs for configured roots that lie inside another root.
+
+    Roots configured by ID are fetched first, then their missing ancestors
+    a tree level per batch. Folders resolved from paths hang off the 'root'
+    alias, which stands for my_drive_id when it is known.
+    """
+    roots_by_id = {root['id']: root for root in roots}
+    unknown = [root_id for root_id in roots_by_id if tree.get(root_id) is None]
+    for metadata in batch_get_files(service, unknown, 'id, name, parents').values():
+        parents = metadata.get('parents', [])
+        tree.add(metadata, parents[0] if parents else None)
+    parent_ids = {tree.parent_id(root_id) for root_id in roots_by_id} - {None, 'root'}
+    prefetch_ancestors(service, parent_ids, roots_by_id, tree)
+
+    nested = []
+    for root in roots:
+        seen = {root['id']}
+        current = tree.parent_id(root['id'])
+        while current and current not in seen:
+            if current == 'root' and my_drive_id:
+                current = my_drive_id
+            if current in roots_by_id:
+                nested.append((root, roots_by_id[current]))
+                break
+            seen.add(current)
+            current = tree.parent_id(current)
+    return nested
+
+def scan_roots(service, roots, state, dry_run=False, converted_files=None, page_size=PAGE_SIZE, pipeline=None,
+               tree=None, listers=1, my_drive_id=None):
+    """Scan every configured root concurrently, sharing one crawl and its `listers` threads.
+
+    Roots that repeat or lie inside another root are detected up front; the
+    shared folders are scanned once, under the innermost root's config.
+    A root configured as My Drive is scanned by its real ID, my_drive_id.
+    """
+    if tree is None:
+        tree = DriveTree()
+    if my_drive_id:
+        for root in roots:
+            if root['id'] == 'root':
+                root['id'] = my_drive_id
+
+    seeds = []
+    seen = {}
+    for root in roots:
+        if root['id'] in seen:
+            logging.warning(f"Folder {root['name']} ({root['id']}) is configured more than once; "
+                            f"scanning it once into {seen[root['id']]['local_dir']}")
+            continue
+        seen[root['id']] = root
+        logging.info(f"Scanning folder: {root['name']} ({root['id']})")
+        seeds.append((root['id'], root['local_dir']))
+    if len(seeds) > 1:
+        for inner, outer in find_nested_roots(service, list(seen.values()), tree, my_drive_id=my_drive_id):
+            logging.info(f"Folder {inner['name']} ({inner['id']}) is inside {outer['name']}; "
+                         f"it is scanned once, into {inner['local_dir']}")
+
+    scan_folders(service, seeds, state, dry_run=dry_run, converted_files=converted_files, page_size=page_size,
+                 pipeline=pipeline, tree=tree, listers=listers)
+
+def scan_one_folder(service, folder_id, local_dir, state, dry_run=False, converted_files=None, page_size=PAGE_SIZE,
+                    pipeline=None, tree=None):
+    """List one folder, dispatch its docs and return its subfolders as (id, local_dir, folder_id, name)."""
     logging.info(f"Scanning folder ID: {folder_id} -> Local: {local_dir}")
 
     if not dry_run:
@@ -226,80 +1934,151 @@ def scan_folder(service, folder_id, local_dir, state, dry_run=False, converted_f
     elif not os.path.exists(local_dir):
          logging.info(f"Would create directory: {local_dir} (Dry Run)")
 
+    subfolders = []
     try:
+        # One listing answers both the doc/subfolder enumeration and the
+        # "do the .md/.pdf outputs already exist" checks below.
+        list_folder(service, tree, folder_id, page_size=page_size)
+
         # 1. Process Documents
-        query_docs = f"'{folder_id}' in parents and mimeType = 'application/vnd.google-apps.document' and trashed = false"
-        results_docs = service.files().list(q=query_docs, fields="nextPageToken, files(id, name, modifiedTime)").execute()
-        items_docs = results_docs.get('files', [])
+        for node in tree.children_of(folder_id, DOC_MIME_TYPE):
+            # The doc was listed in folder_id, so that is where its outputs
+            # go without any parents lookup
+            process_document(service, node, folder_id, tree, local_dir, state, dry_run=dry_run, converted_files=converted_files,
+                             pipeline=pipeline, parents=[folder_id])
 
-        for item in items_docs:
-            file_id = item['id']
-            file_name = item['name']
-            modified_time = item['modifiedTime']
+        # 2. Collect Subfolders, following shortcuts to folders
+        for node in tree.children_of(folder_id):
+            if node.mime_type == FOLDER_MIME_TYPE:
+                target = node.id
+            elif node.mime_type == SHORTCUT_MIME_TYPE and node.target:
+                target = node.target
+            else:
+                continue
+            # Sanitize folder name for local path
+            sub_local_dir = os.path.join(local_dir, sanitize_name(node.name))
+            subfolders.append((target, sub_local_dir, folder_id, node.name))
+    except Exception as e:
+        logging.error(f"Error scanning folder {folder_id}: {e}")
+    return subfolders
 
-            # Check if changed
-            last_recorded_time = state.get(file_id)
+def prefetch_ancestors(service, folder_ids, roots_by_id, tree):
+    """Add every ancestor of folder_ids to the tree, one batch per tree level."""
+    def unknown(ids):
+        return {i for i in ids if tree.get(i) is None and i not in roots_by_id}
 
-            # Check if markdown and PDF files exist in Drive
-            file_metadata = service.files().get(fileId=file_id, fields='parents').execute()
-            parents = file_metadata.get('parents', [])
-            need_conversion = False
-
-            if parents:
-                parent_id = parents[0]
-                md_filename = f"{file_name}.md"
-                pdf_filename = f"{file_name}.pdf"
-
-                # Check for markdown file
-                query_md = f"name = '{md_filename}' and '{parent_id}' in parents and trashed = false"
-                results_md = service.files().list(q=query_md, fields="files(id)").execute()
-                md_exists = len(results_md.get('files', [])) > 0
-
-                # Check for PDF file
-                query_pdf = f"name = '{pdf_filename}' and '{parent_id}' in parents and trashed = false"
-                results_pdf = service.files().list(q=query_pdf, fields="files(id)").execute()
-                pdf_exists = len(results_pdf.get('files', [])) > 0
-
-                if not md_exists or not pdf_exists:
-                    logging.info(f"File {file_name} outputs missing (md: {md_exists}, pdf: {pdf_exists}). Converting...")
-                    need_conversion = True
-
-            if last_recorded_time != modified_time or need_conversion:
-                if not need_conversion:
-                    logging.info(f"File {file_name} changed (new: {modified_time}, old: {last_recorded_time}). Converting...")
-                if convert_to_markdown(service, file_id, file_name, local_dir, dry_run=dry_run):
-                    if not dry_run:
-                        state[file_id] = modified_time
-                        save_state(state)
-                    if converted_files is not None:
-                        # Store as tuple: (folder_path, filename)
-                        display_path = f"{folder_path}/{file_name}" if folder_path else file_name
-                        converted_files.append((display_path, file_name))
-            else:
-                logging.info(f"File {file_name} unchanged and outputs exist.")
+    frontier = unknown(folder_ids)
+    while frontier:
+        fetched = batch_get_files(service, sorted(frontier), 'id, name, parents')
+        for metadata in fetched.values():
+            parents = metadata.get('parents', [])
+            tree.add(metadata, parents[0] if parents else None)
+        frontier = unknown(m['parents'][0] for m in fetched.values() if m.get('parents'))
 
-        # 2. Process Subfolders (Recursive)
-        query_folders = f"'{folder_id}' in parents and mimeType = 'application/vnd.google-apps.folder' and trashed = false"
-        results_folders = service.files().list(q=query_folders, fields="nextPageToken, files(id, name)").execute()
-        items_folders = results_folders.get('files', [])
-        
-        for folder in items_folders:
-            sub_folder_id = folder['id']
-            sub_folder_name = folder['name']
+def locate_under_roots(service, folder_id, roots_by_id, tree):
+    """Walk up the parent chain of folder_id until a configured root is hit.
 
-            # Sanitize folder name for local path
-            safe_folder_name = "".join([c for c in sub_folder_name if c.isalpha() or c.isdigit() or c in (' ', '-', '_')]).strip()
-            sub_local_dir = os.path.join(local_dir, safe_folder_name)
+    Returns (root, [folder names from the root down to folder_id]) or None if
+    the folder is not below any root. Folders missing from the tree are
+    fetched and added, so docs in the same folder only pay for the walk once.
+    """
+    names = []
+    current = folder_id
+    seen = set()
+    while current and current not in seen:
+        if current in roots_by_id:
+            return roots_by_id[current], list(reversed(names))
+        seen.add(current)
+        node = tree.get(current)
+        if node is None:
+            metadata = execute_request(service.files().get(fileId=current, fields='id, name, parents', supportsAllDrives=True))
+            parents = metadata.get('parents', [])
+            node = tree.add(metadata, parents[0] if parents else None)
+        names.append(node.name or '')
+        current = tree.parent_id(current)
+    return None
 
-            # Build folder path for display
-            sub_folder_path = f"{folder_path}/{sub_folder_name}" if folder_path else sub_folder_name
+def fetch_changed_docs(service, page_token, page_size=PAGE_SIZE):
+    """Return (changed docs, new start page token) for all changes since page_token."""
+    changed = {}
+    while page_token:
+        results = execute_request(service.changes().list(
+            pageToken=page_token,
+            pageSize=max(1, min(page_size, MAX_PAGE_SIZE)),
+            spaces='drive',
+            includeRemoved=False,
+            **ALL_DRIVES_LIST,
+            fields="nextPageToken, newStartPageToken, changes(fileId, removed, file(id, name, mimeType, modifiedTime, parents, trashed))"
+        ))
+        for change in results.get('changes', []):
+            file = change.get('file')
+            if change.get('removed') or not file or file.get('trashed'):
+                changed.pop(change.get('fileId'), None)
+                continue
+            if file.get('mimeType') == DOC_MIME_TYPE:
+                # Later changes for the same doc supersede earlier ones
+                changed[file['id']] = file
+        if 'newStartPageToken' in results:
+            return list(changed.values()), results['newStartPageToken']
+        page_token = results.get('nextPageToken')
+    return list(changed.values()), page_token
 
-            scan_folder(service, sub_folder_id, sub_local_dir, state, dry_run=dry_run, converted_files=converted_files, folder_path=sub_folder_path)
-            
-    except Exception as e:
-        logging.error(f"Error scanning folder {folder_id}: {e}")
+def sync_changes(service, roots, state, dry_run=False, converted_files=None, page_size=PAGE_SIZE, pipeline=None, tree=None,
+                 my_drive_id=None):
+    """Convert only the docs under the configured roots that changed since the last run.
+
+    my_drive_id is the real ID of a root configured as My Drive.
 
-def print_conversion_report(converted_files, dry_run=False):
+    Returns the new start page token; the caller records it once every
+    queued conversion has finished.
+    """
+    page_token = state.get(CHANGES_TOKEN_KEY)
+    changed_docs, new_page_token = fetch_changed_docs(service, page_token, page_size=page_size)
+    logging.info(f"{len(changed_docs)} changed document(s) reported since the last run")
+
+    changed_ids = {item['id'] for item in changed_docs}
+    retry_ids = [file_id for file_id in state.get(FAILED_DOCS_KEY) or [] if file_id not in changed_ids]
+    if retry_ids:
+        logging.info(f"Retrying {len(retry_ids)} document(s) that failed on the last run")
+        for item in batch_get_files(service, retry_ids, 'id, name, mimeType, modifiedTime, parents, trashed').values():
+            if item.get('mimeType') == DOC_MIME_TYPE and not item.get('trashed'):
+                changed_docs.append(item)
+
+    roots_by_id = {root['id']: root for root in roots}
+    if my_drive_id and 'root' in roots_by_id:
+        roots_by_id[my_drive_id] = roots_by_id['root']
+
+    if tree is None:
+        tree = DriveTree()
+    prefetch_ancestors(service, [item['parents'][0] for item in changed_docs if item.get('parents')], roots_by_id, tree)
+    for item in changed_docs:
+        parents = item.get('parents', [])
+        location = locate_under_roots(service, parents[0], roots_by_id, tree) if parents else None
+        if not location:
+            continue
+        root, folder_names = location
+        parent_id = parents[0]
+        try:
+            list_folder(service, tree, parent_id, page_size=page_size)
+            node = tree.add(item, parent_id)
+            local_dir = os.path.join(root['local_dir'], *[sanitize_name(name) for name in folder_names])
+            tree.set_path(parent_id, "/".join(folder_names), base_id=root['id'])
+            process_document(service, node, parent_id, tree, local_dir, state, dry_run=dry_run,
+                             converted_files=converted_files, pipeline=pipeline, parents=parents)
+        except Exception as e:
+            logging.error(f"Error processing changed document {item.get('name')}: {e}")
+            record_failure(item['id'])
+
+    return new_page_token
+
+def log_run_stats(stats):
+    lines = [f"{label}: {stats[name]}" for name, label in STAT_LABELS.items() if stats.get(name)]
+    if lines:
+        logging.info(f"{'-'*60}")
+        for line in lines:
+            logging.info(line)
+
+def print_conversion_report(converted_files, dry_run=False, stats=None):
     """Print a summary report of converted documents."""
     if not converted_files:
         action = "would be" if dry_run else "were"
@@ -307,6 +2086,7 @@ def print_conversion_report(converted_files, dry_run=False):
         logging.info(f"Conversion Report")
         logging.info(f"{'='*60}")
         logging.info(f"No documents {action} converted.")
+        log_run_stats(stats or {})
         logging.info(f"{'='*60}\n")
         return
 
@@ -325,23 +2105,74 @@ def print_conversion_report(converted_files, dry_run=False):
         else:
             # backward compatibility - item is just filename
             logging.info(f"{i}. {item}")
+    log_run_stats(stats or {})
     logging.info(f"{'='*60}\n")
 
-@app.command()
-def main(dry_run: bool = typer.Option(False, "--dry-run", help="Run without making changes")):
-    config = load_config()
-    if not config:
-        return
+def load_benchmark_corpus(path):
+    """Doc IDs to benchmark, one per line; blank lines and '#' comments are ignored."""
+    with open(path, 'r') as f:
+        lines = [line.split('#', 1)[0].strip() for line in f]
+    return [line for line in lines if line]
 
-    state = load_state()
-    service = get_service()
+def benchmark_converters(service, doc_ids, converters=None):
+    """Export and convert every doc with each converter and compare the results.
 
-    if not service:
-        return
+    Returns {converter: {'docs', 'failures', 'seconds', 'cpu_seconds',
+    'bytes', 'similarity'}}. seconds is wall time for export plus
+    conversion, cpu_seconds the process CPU spent on it, and similarity the
+    mean line-level difflib ratio against Drive's native export of the same
+    doc (None when the native export is not part of the comparison).
+    """
+    converters = converters or CONVERTERS
+    results = {name: {'docs': 0, 'failures': 0, 'seconds': 0.0, 'cpu_seconds': 0.0, 'bytes': 0, 'similarity': []}
+               for name in converters}
+    for doc_id in doc_ids:
+        outputs = {}
+        for name in converters:
+            wall_start, cpu_start = time.perf_counter(), time.process_time()
+            try:
+                used, exported, _ = export_for_conversion(service, doc_id, doc_id, name, fallback=False)
+                md_content = render_markdown(used, exported)
+            except Exception as e:
+                logging.warning(f"Benchmark of {name} on {doc_id} failed: {e}")
+                results[name]['failures'] += 1
+                continue
+            results[name]['seconds'] += time.perf_counter() - wall_start
+            results[name]['cpu_seconds'] += time.process_time() - cpu_start
+            results[name]['docs'] += 1
+            results[name]['bytes'] += len(md_content.encode('utf-8'))
+            outputs[name] = md_content
 
-    # Track all converted files across all directories
-    converted_files = []
+        reference = outputs.get('native')
+        if reference is not None:
+            for name, md_content in outputs.items():
+                matcher = difflib.SequenceMatcher(None, reference.splitlines(), md_content.splitlines(), autojunk=False)
+                results[name]['similarity'].append(matcher.ratio())
+
+    for stats in results.values():
+        scores = stats['similarity']
+        stats['similarity'] = sum(scores) / len(scores) if scores else None
+    return results
+
+def print_benchmark_report(results):
+    """Print the per-converter totals from benchmark_converters."""
+    logging.info(f"\n{'='*60}")
+    logging.info(f"Converter Benchmark")
+    logging.info(f"{'='*60}")
+    for name, stats in results.items():
+        similarity = f"{stats['similarity']:.1%}" if stats['similarity'] is not None else "n/a"
+        logging.info(f"{name}: {stats['docs']} docs ({stats['failures']} failed), {stats['seconds']:.2f}s wall, "
+                     f"{stats['cpu_seconds']:.2f}s CPU, {stats['bytes']} bytes, {similarity} similar to native")
+    logging.info(f"{'='*60}\n")
+
+def resolve_roots(service, config, page_size=PAGE_SIZE, tree=None, path_cache=None, workers=1):
+    """Turn config['directories'] into a list of {'id', 'name', 'local_dir'} roots.
 
+    With a path_cache, the cached IDs along every configured path are
+    validated in one batch up front and only stale or new segments are
+    looked up. Paths are resolved together on up to `workers` threads.
+    """
+    entries = []
     for directory in config.get('directories', []):
         folder_id = None
         path = None
@@ -367,29 +2198,167 @@ def main(dry_run: bool = typer.Option(False, "--dry-run", help="Run without maki
         if not folder_id and not path:
              logging.error(f"Directory entry {directory} invalid. Skipping.")
              continue
-             
+        entries.append((folder_id, path, folder_name, custom_output_dir))
+
+    paths = [path for folder_id, path, _, _ in entries if not folder_id and path]
+    if path_cache is not None:
+        validate_path_cache(service, path_cache, paths)
+    for path in paths:
+        logging.info(f"Resolving path: {path}")
+    resolved = resolve_paths(service, paths, page_size=page_size, tree=tree, path_cache=path_cache, workers=workers)
+
+    roots = []
+    for folder_id, path, folder_name, custom_output_dir in entries:
         if not folder_id and path:
-            logging.info(f"Resolving path: {path}")
-            folder_id = resolve_path_to_id(service, path)
+            folder_id = resolved[path]
             if not folder_id:
                 continue
 
         if not folder_name:
              folder_name = "Unknown"
 
-        logging.info(f"Scanning folder: {folder_name} ({folder_id})")
-        
         # Determine local output directory
         if custom_output_dir:
             local_dir = custom_output_dir
         else:
             local_dir = os.path.join(os.getcwd(), "downloads", folder_name)
-        
-        # Start recursive scan
-        scan_folder(service, folder_id, local_dir, state, dry_run=dry_run, converted_files=converted_files)
+
+        roots.append({'id': folder_id, 'name': folder_name, 'local_dir': local_dir})
+    return roots
+
+@app.command()
+def main(
+    dry_run: Annotated[bool, typer.Option("--dry-run", help="Run without making changes")] = False,
+    page_size: Annotated[int, typer.Option("--page-size", min=1, max=MAX_PAGE_SIZE, help="Results per Drive listing page")] = PAGE_SIZE,
+    incremental: Annotated[bool, typer.Option("--incremental", help="Only convert docs reported by the Drive Changes API since the last run")] = False,
+    workers: Annotated[int, typer.Option("--workers", min=1, help="Number of documents converted concurrently")] = 1,
+    state_backend: Annotated[str, typer.Option("--state-backend", help="Where run state is kept: 'sqlite' or 'json'")] = 'sqlite',
+    traversal: Annotated[str, typer.Option("--traversal", help="'recursive' lists folder by folder; 'tree' enumerates everything in one paginated query")] = 'recursive',
+    drive_id: Annotated[Optional[str], typer.Option("--drive-id", help="Shared drive to enumerate with --traversal tree")] = None,
+    converter: Annotated[str, typer.Option("--converter", help="'native' uses Drive's markdown export (falling back to markdownify); 'markdownify' or 'streaming' convert the HTML export locally")] = DEFAULT_CONVERTER,
+    benchmark: Annotated[Optional[str], typer.Option("--benchmark", help="Instead of converting, compare all converters on the doc IDs listed in this file")] = None,
+    list_workers: Annotated[int, typer.Option("--list-workers", min=1, help="Number of folders listed concurrently while crawling")] = LIST_WORKERS,
+    convert_processes: Annotated[int, typer.Option("--convert-processes", min=0, help="Worker processes for HTML-to-markdown conversion (0 converts on the calling thread)")] = 0,
+    convert_timeout: Annotated[float, typer.Option("--convert-timeout", min=1, help="Seconds a single conversion may run in a worker process before it is killed")] = CONVERT_TIMEOUT,
+    transport: Annotated[str, typer.Option("--transport", help="'httplib2' opens a connection per thread; 'requests' shares a pool of keep-alive, gzip-compressed connections between all threads; 'http2' shares a few multiplexed HTTP/2 connections (needs httpx[http2])")] = DEFAULT_TRANSPORT,
+    pool_size: Annotated[int, typer.Option("--pool-size", min=1, help="Connections kept alive by the 'requests' transport")] = SESSION_POOL_SIZE,
+):
+    global _transport, _pool_size, _credentials
+    if converter not in CONVERTERS:
+        logging.error(f"Unknown converter '{converter}', expected one of: {', '.join(CONVERTERS)}")
+        return
+    if transport not in TRANSPORTS:
+        logging.error(f"Unknown transport '{transport}', expected one of: {', '.join(TRANSPORTS)}")
+        return
+    if traversal not in TRAVERSALS:
+        logging.error(f"Unknown traversal '{traversal}', expected one of: {', '.join(TRAVERSALS)}")
+        return
+    if state_backend not in STATE_BACKENDS:
+        logging.error(f"Unknown state backend '{state_backend}', expected one of: {', '.join(STATE_BACKENDS)}")
+        return
+    _transport = transport
+    _pool_size = pool_size
+    try:
+        if benchmark:
+            _credentials = get_credentials()
+            service = get_service(_credentials) if _credentials else None
+            if service:
+                print_benchmark_report(benchmark_converters(service, load_benchmark_corpus(benchmark)))
+            return
+
+        config = load_config()
+        if not config:
+            return
+
+        _credentials = get_credentials()
+        if not _credentials:
+            return
+        service = get_service(_credentials)
+
+        if not service:
+            return
+
+        state = load_state(state_backend, read_only=dry_run)
+        try:
+            run(service, config, state, dry_run=dry_run, page_size=page_size, incremental=incremental, workers=workers,
+                traversal=traversal, drive_id=drive_id, converter=converter, convert_processes=convert_processes,
+                convert_timeout=convert_timeout, list_workers=list_workers)
+        finally:
+            close_state(state)
+    finally:
+        shutdown_shared_transport()
+        _credentials = None
+
+def run(service, config, state, dry_run=False, page_size=PAGE_SIZE, incremental=False, workers=1, traversal='recursive', drive_id=None,
+        converter=DEFAULT_CONVERTER, convert_processes=0, convert_timeout=CONVERT_TIMEOUT, list_workers=1):
+    """Resolve the configured roots, convert what changed and print the report."""
+    global _converter
+    _converter = converter
+    # Track all converted files across all directories
+    converted_files = []
+    RUN_STATS.clear()
+    FAILED_DOCS.clear()
+
+    # One snapshot of everything this run lists, shared by all roots
+    tree = DriveTree()
+    path_cache = load_path_cache(state)
+    roots = resolve_roots(service, config, page_size=page_size, tree=tree, path_cache=path_cache, workers=list_workers)
+    if not dry_run:
+        state[PATH_CACHE_KEY] = path_cache
+        save_state(state)
+    my_drive_id = None
+    if any(root['id'] == 'root' for root in roots):
+        my_drive_id = get_my_drive_id(service)
+
+    # With several workers or listers docs flow through the export/convert/
+    # upload pipeline; otherwise they convert one at a time on this thread,
+    # with the PDF export overlapping the markdown one.
+    pipeline = None
+    if workers > 1 or list_workers > 1:
+        pipeline = ConversionPipeline(export_workers=workers, convert_workers=max(1, convert_processes),
+                                      upload_workers=workers, queue_size=PIPELINE_QUEUE_SIZE_PER_WORKER * workers)
+    else:
+        start_export_pool(1)
+    if convert_processes:
+        # Also used by the native converter's markdownify fallback
+        start_convert_pool(convert_processes, timeout=convert_timeout)
+    new_page_token = None
+    try:
+        if incremental and state.get(CHANGES_TOKEN_KEY):
+            new_page_token = sync_changes(service, roots, state, dry_run=dry_run, converted_files=converted_files,
+                                          page_size=page_size, pipeline=pipeline, tree=tree, my_drive_id=my_drive_id)
+        else:
+            if incremental:
+                # First incremental run: take the token before crawling so that
+                # edits made during the full scan are picked up next time.
+                logging.info("No Changes API token recorded yet, running a full scan")
+                new_page_token = execute_request(service.changes().getStartPageToken(supportsAllDrives=True))['startPageToken']
+
+            if traversal == 'tree':
+                build_drive_tree(service, drive_id=drive_id, page_size=page_size, tree=tree)
+
+            scan_roots(service, roots, state, dry_run=dry_run, converted_files=converted_files, page_size=page_size,
+                       pipeline=pipeline, tree=tree, listers=list_workers, my_drive_id=my_drive_id)
+    finally:
+        if pipeline is not None:
+            pipeline.close()
+        shutdown_export_pool()
+        shutdown_convert_pool()
+
+    if not dry_run:
+        if new_page_token:
+            state[CHANGES_TOKEN_KEY] = new_page_token
+        if FAILED_DOCS or state.get(FAILED_DOCS_KEY):
+            # The token moves past these docs' changes, so remember them for a retry
+            state[FAILED_DOCS_KEY] = sorted(FAILED_DOCS)
+        save_state(state)
+
+    if pipeline is not None or list_workers > 1 or len(roots) > 1:
+        # Completion order is arbitrary with several workers
+        converted_files.sort()
 
     # Print conversion report at the end
-    print_conversion_report(converted_files, dry_run=dry_run)
+    print_conversion_report(converted_files, dry_run=dry_run, stats=RUN_STATS)
 
 if __name__ == '__main__':
     app()
@@ -1,5 +1,8 @@
+import io
 import os
+import re
 import json
+import hashlib
 import yaml
 import pytest
 from unittest.mock import MagicMock, patch, call
@@ -25,6 +28,19 @@ def mock_state(tmp_path):
     state_file = tmp_path / 'state.json'
     return str(state_file)
 
+@pytest.fixture(autouse=True)
+def no_oauth():
+    """Keep main() from reading token.json or starting the browser flow."""
+    with patch('src.main.get_credentials', return_value=MagicMock()) as mock_credentials:
+        yield mock_credentials
+
+@pytest.fixture(autouse=True)
+def fresh_limiters():
+    """Give every test its own rate limiters so buckets drained by one test don't slow the next."""
+    limiters = {kind: main.AdaptiveLimiter(kind, **limits) for kind, limits in main.RATE_LIMITS.items()}
+    with patch.dict(main.LIMITERS, limiters):
+        yield limiters
+
 def test_resolve_path_to_id():
     mock_service = MagicMock()
     
@@ -41,6 +57,23 @@ def test_resolve_path_to_id():
     assert result == 'folder_id'
     assert mock_list.call_count == 3
 
+def test_resolve_path_follows_next_page_token():
+    mock_service = MagicMock()
+    mock_list = mock_service.files.return_value.list
+
+    # The folder only shows up on the second page of the listing
+    mock_list.return_value.execute.side_effect = [
+        {'files': [], 'nextPageToken': 'page2'},
+        {'files': [{'id': 'path_id'}]},
+    ]
+
+    result = main.resolve_path_to_id(mock_service, 'Path', page_size=50)
+    assert result == 'path_id'
+    assert mock_list.call_count == 2
+    assert mock_list.call_args_list[1].kwargs['pageToken'] == 'page2'
+    assert all(c.kwargs['pageSize'] == 50 for c in mock_list.call_args_list)
+    assert mock_list.call_args_list[0].kwargs['fields'] == "nextPageToken, files(id)"
+
 def test_resolve_path_not_found():
     mock_service = MagicMock()
     mock_files = mock_service.files.return_value
@@ -55,100 +88,296 @@ def test_resolve_path_not_found():
     result = main.resolve_path_to_id(mock_service, 'Path/Missing')
     assert result is None
 
+def test_resolve_roots_caches_shared_path_prefixes():
+    drive = {
+        'root': [folder('team_id', 'Team')],
+        'team_id': [folder('eng_id', 'Eng')],
+        'eng_id': [folder('a_id', 'A'), folder('b_id', 'B')],
+    }
+    config = {'directories': ['Team/Eng/A', 'Team/Eng/B']}
+    mock_service = make_fake_drive(drive)
+    mock_files = mock_service.files.return_value
+    path_cache = main.load_path_cache({})
+
+    roots = main.resolve_roots(mock_service, config, path_cache=path_cache)
+
+    assert [r['id'] for r in roots] == ['a_id', 'b_id']
+    # Team and Eng are looked up once for both paths
+    assert mock_files.list.call_count == 4
+
+    # Next run: the cached IDs are validated in one batch, nothing is listed
+    mock_service = make_fake_drive(drive)
+    mock_files = mock_service.files.return_value
+    roots = main.resolve_roots(mock_service, config, path_cache=path_cache)
+    assert [r['id'] for r in roots] == ['a_id', 'b_id']
+    assert mock_service.new_batch_http_request.call_count == 1
+    assert mock_files.list.call_count == 0
+
+    # B was replaced by a new folder: only that segment is resolved again
+    drive['eng_id'] = [folder('a_id', 'A'), folder('b2_id', 'B')]
+    mock_service = make_fake_drive(drive)
+    mock_files = mock_service.files.return_value
+    roots = main.resolve_roots(mock_service, config, path_cache=path_cache)
+    assert [r['id'] for r in roots] == ['a_id', 'b2_id']
+    assert mock_files.list.call_count == 1
+    assert path_cache['children']['Team']['children']['Eng']['children']['B']['id'] == 'b2_id'
+
+
+EXPORT_HTML = b"<h1>Title</h1><p>Content</p>"
+EXPORT_MARKDOWN = b"# Title\n\nContent"
+
+class FakeDownloader:
+    """Stand-in for MediaIoBaseDownload that writes a canned export in one chunk.
+
+    make_fake_drive hands the export mime type over as the request.
+    """
+    def __init__(self, fh, request):
+        fh.write(EXPORT_MARKDOWN if request == 'text/markdown' else EXPORT_HTML)
+
+    def next_chunk(self):
+        return None, True
+
+class FakeBatch:
+    """Stand-in for BatchHttpRequest that runs the queued requests on execute()."""
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id=None):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        for request_id, request in self.requests:
+            try:
+                response, exception = request.execute(), None
+            except Exception as e:
+                response, exception = None, e
+            self.callback(request_id, response, exception)
+
+def make_fake_drive(children):
+    """Build a mock Drive service answering files().list/get from a {parent_id: [items]} tree."""
+    service = MagicMock()
+    files = service.files.return_value
+    parent_of = {item['id']: parent for parent, items in children.items() for item in items}
+    by_id = {item['id']: item for items in children.values() for item in items}
+
+    def list_side_effect(q='', **kwargs):
+        parent = re.search(r"'([^']+)' in parents", q)
+        if parent:
+            items = [dict(i) for i in children.get(parent.group(1), [])]
+        else:
+            # Whole-tree query: every file, with its parents
+            items = [dict(i, parents=[p]) for p, group in children.items() for i in group]
+        name = re.search(r"name = '([^']*)'", q)
+        if name:
+            items = [i for i in items if i['name'] == name.group(1)]
+        mime_types = re.findall(r"mimeType = '([^']*)'", q)
+        if mime_types:
+            items = [i for i in items if i.get('mimeType') in mime_types]
+        request = MagicMock()
+        request.execute.return_value = {'files': items}
+        return request
+
+    def get_side_effect(fileId=None, **kwargs):
+        request = MagicMock()
+        parents = [parent_of[fileId]] if fileId in parent_of else []
+        request.execute.return_value = dict(by_id.get(fileId, {'name': None}), id=fileId, parents=parents)
+        return request
+
+    files.list.side_effect = list_side_effect
+    files.get.side_effect = get_side_effect
+    service.new_batch_http_request.side_effect = FakeBatch
+    files.export_media.side_effect = lambda fileId, mimeType: mimeType
+    files.create.return_value.execute.return_value = {'id': 'created_id'}
+    files.update.return_value.execute.return_value = {'id': 'updated_id'}
+    return service
+
+def read_state(state_file):
+    """Load the state a run persisted for state_file, as a plain dict."""
+    with patch('src.main.STATE_FILE', state_file):
+        state = main.load_state()
+        try:
+            return dict(state)
+        finally:
+            main.close_state(state)
+
+def doc(file_id, name, modified_time='2023-10-26T10:00:00Z'):
+    return {'id': file_id, 'name': name, 'mimeType': main.DOC_MIME_TYPE, 'modifiedTime': modified_time}
+
+def folder(folder_id, name):
+    return {'id': folder_id, 'name': name, 'mimeType': main.FOLDER_MIME_TYPE}
 
 def test_main_workflow(mock_config, mock_state, tmp_path):
-    # Setup paths
+    mock_service = make_fake_drive({
+        'root': [folder('path_id', 'Path')],
+        'path_id': [folder('to_id', 'To')],
+        'to_id': [folder('folder_id', 'Folder')],
+        'folder123': [
+            doc('file1', 'Doc 1', '2023-10-26T10:00:00Z'),
+            doc('file2', 'Doc 2', '2023-10-26T11:00:00Z'),
+        ],
+        'folder_id': [doc('file3', 'Doc 3', '2023-10-26T12:00:00Z')],
+    })
+    mock_files = mock_service.files.return_value
+
     with patch('src.main.CONFIG_FILE', mock_config), \
          patch('src.main.STATE_FILE', mock_state), \
          patch('os.getcwd', return_value=str(tmp_path)), \
-         patch('src.main.get_service') as mock_get_service, \
-         patch('src.main.MediaIoBaseDownload') as mock_downloader_cls, \
-         patch('io.BytesIO') as mock_io_cls:
-        
-        # Mock Service
-        mock_service = MagicMock()
-        mock_get_service.return_value = mock_service
-        
-        # Mock List Files
-        mock_files = mock_service.files.return_value
-        mock_list = mock_files.list
-        
-        # Sequence:
-        # 1. Scan 'Test Folder' (id='folder123')
-        #    - List Docs -> 2 docs
-        #    - List Subfolders -> 0 folders
-        # 2. Resolve 'Path/To/Folder' -> 3 calls
-        #    - Path -> path_id
-        #    - To -> to_id
-        #    - Folder -> folder_id
-        # 3. Scan 'Folder' (from 'Path/To/Folder') (id='folder_id')
-        #    - List Docs -> 1 doc
-        #    - List Subfolders -> 0 folders
-        
-        scan_1_docs = {
-            'files': [
-                {'id': 'file1', 'name': 'Doc 1', 'modifiedTime': '2023-10-26T10:00:00Z'},
-                {'id': 'file2', 'name': 'Doc 2', 'modifiedTime': '2023-10-26T11:00:00Z'}
-            ]
-        }
-        scan_1_folders = {'files': []}
-        
-        # Path resolution results
-        res_path = {'files': [{'id': 'path_id', 'name': 'Path'}]}
-        res_to = {'files': [{'id': 'to_id', 'name': 'To'}]}
-        res_folder = {'files': [{'id': 'folder_id', 'name': 'Folder'}]}
-        
-        scan_2_docs = {
-            'files': [
-                {'id': 'file3', 'name': 'Doc 3', 'modifiedTime': '2023-10-26T12:00:00Z'}
-            ]
-        }
-        scan_2_folders = {'files': []}
-        
-        mock_list.return_value.execute.side_effect = [
-            scan_1_docs,     # Scan 1 Docs
-            scan_1_folders,  # Scan 1 Folders
-            res_path,        # Resolve 1
-            res_to,          # Resolve 2
-            res_folder,      # Resolve 3
-            scan_2_docs,     # Scan 2 Docs
-            scan_2_folders   # Scan 2 Folders
-        ]
-        
-        # Mock Download (Export)
-        mock_downloader_instance = MagicMock()
-        mock_downloader_cls.return_value = mock_downloader_instance
-        # We expect 3 conversions total (html + pdf for each = 6 downloads)
-        mock_downloader_instance.next_chunk.side_effect = [(None, True)] * 6
-        
-        # Mock io.BytesIO
-        mock_buffer = MagicMock()
-        mock_buffer.getvalue.return_value = b"<h1>Title</h1><p>Content</p>"
-        mock_io_cls.return_value = mock_buffer
-        
-        # Run main
+         patch('src.main.get_service', return_value=mock_service), \
+         patch('src.main.MediaIoBaseDownload', FakeDownloader), \
+         patch('src.main.ConversionPipeline') as mock_pipeline, \
+         patch('src.main.start_export_pool', wraps=main.start_export_pool) as mock_export_pool:
+
         main.main(dry_run=False)
-        
-        # Verify export called for 3 files (2 calls per file)
-        assert mock_files.export_media.call_count == 6
-        
-        # Verify files created
-        output_dir_1 = tmp_path / 'downloads' / 'Test Folder'
-        assert (output_dir_1 / 'Doc 1.md').exists()
-        assert (output_dir_1 / 'Doc 1.pdf').exists()
-        assert (output_dir_1 / 'Doc 2.md').exists()
-        assert (output_dir_1 / 'Doc 2.pdf').exists()
-        
-        output_dir_2 = tmp_path / 'downloads' / 'Folder'
-        assert (output_dir_2 / 'Doc 3.md').exists()
-        assert (output_dir_2 / 'Doc 3.pdf').exists()
-        
-        # Verify state updated
-        with open(mock_state, 'r') as f:
-            state = json.load(f)
-            assert state['file1'] == '2023-10-26T10:00:00Z'
-            assert state['file2'] == '2023-10-26T11:00:00Z'
-            assert state['file3'] == '2023-10-26T12:00:00Z'
+
+    # The default run converts inline, overlapping each doc's PDF export
+    assert mock_pipeline.call_count == 0
+    mock_export_pool.assert_called_once_with(1)
+
+    # Verify export called for 3 files (2 calls per file)
+    assert mock_files.export_media.call_count == 6
+
+    # Both outputs of every doc were uploaded next to it, nothing fell back locally
+    assert mock_files.create.call_count == 6
+    created = sorted(c.kwargs['body']['name'] for c in mock_files.create.call_args_list)
+    assert created == ['Doc 1.md', 'Doc 1.pdf', 'Doc 2.md', 'Doc 2.pdf', 'Doc 3.md', 'Doc 3.pdf']
+    assert not (tmp_path / 'downloads' / 'Test Folder' / 'Doc 1.md').exists()
+
+    # Verify state updated
+    state = read_state(mock_state)
+    assert state['file1']['modifiedTime'] == '2023-10-26T10:00:00Z'
+    assert state['file2']['modifiedTime'] == '2023-10-26T11:00:00Z'
+    assert state['file3']['modifiedTime'] == '2023-10-26T12:00:00Z'
+    assert state['file1']['contentHash'] == hashlib.sha256(EXPORT_MARKDOWN).hexdigest()
+
+def test_main_workflow_with_worker_pool(mock_config, mock_state, tmp_path, no_oauth):
+    mock_service = make_fake_drive({
+        'root': [folder('path_id', 'Path')],
+        'path_id': [folder('to_id', 'To')],
+        'to_id': [folder('folder_id', 'Folder')],
+        'folder123': [doc(f'file{i}', f'Doc {i}') for i in range(1, 7)],
+        'folder_id': [doc('file7', 'Doc 7')],
+    })
+
+    with patch('src.main.CONFIG_FILE', mock_config), \
+         patch('src.main.STATE_FILE', mock_state), \
+         patch('os.getcwd', return_value=str(tmp_path)), \
+         patch('src.main.get_service', return_value=mock_service) as mock_get_service, \
+         patch('src.main.MediaIoBaseDownload', FakeDownloader), \
+         patch('src.main.print_conversion_report') as mock_report:
+
+        main.main(dry_run=False, workers=3)
+
+    # Main thread plus at most one service per lister, export, PDF export and upload thread
+    assert 2 <= mock_get_service.call_count <= 1 + main.LIST_WORKERS + 3 + 3 + 3
+    # Credentials are loaded once and every thread builds its client from them
+    assert no_oauth.call_count == 1
+    assert {c.args for c in mock_get_service.call_args_list} == {(no_oauth.return_value,)}
+    assert mock_service.files.return_value.create.call_count == 14
+
+    # Report is complete and in a stable order despite concurrent completion
+    converted_files = mock_report.call_args.args[0]
+    assert converted_files == sorted(converted_files)
+    assert len(converted_files) == 7
+
+    state = read_state(mock_state)
+    assert sorted(state) == [main.PATH_CACHE_KEY] + [f'file{i}' for i in range(1, 8)]
+
+def test_pipeline_bounds_docs_in_flight(tmp_path):
+    import threading
+    import time
+    mock_service = make_fake_drive({'folder123': [doc(f'file{i}', f'Doc {i}') for i in range(12)]})
+    in_flight, peak = [0], [0]
+    lock = threading.Lock()
+    export_for_conversion, upload_outputs = main.export_for_conversion, main.upload_outputs
+
+    def counting_export(*args, **kwargs):
+        with lock:
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+        return export_for_conversion(*args, **kwargs)
+
+    def slow_upload(*args, **kwargs):
+        time.sleep(0.01)
+        try:
+            return upload_outputs(*args, **kwargs)
+        finally:
+            with lock:
+                in_flight[0] -= 1
+
+    converted_files = []
+    pipeline = main.ConversionPipeline(export_workers=1, convert_workers=1, upload_workers=1, queue_size=1)
+    with patch('src.main.get_service', return_value=mock_service), \
+         patch('src.main.MediaIoBaseDownload', FakeDownloader), \
+         patch('src.main.export_for_conversion', counting_export), \
+         patch('src.main.upload_outputs', slow_upload), \
+         patch('src.main.save_state'):
+        main.scan_folder(mock_service, 'folder123', str(tmp_path), {}, converted_files=converted_files, pipeline=pipeline)
+        pipeline.close()
+
+    assert len(converted_files) == 12
+    # One doc per stage worker plus one per queue slot, however long the listing
+    assert peak[0] <= 5
+
+def test_pdf_export_overlaps_html_export(tmp_path):
+    """The PDF download runs on the export pool while the HTML is exported."""
+    import threading
+    both_in_flight = threading.Barrier(2, timeout=5)
+    downloaded_on = {}
+
+    class OverlapDownloader:
+        def __init__(self, fh, request):
+            self.fh, self.mime_type = fh, request
+
+        def next_chunk(self):
+            # Each export waits for the other to start; serial exports would time out
+            both_in_flight.wait()
+            downloaded_on[self.mime_type] = threading.current_thread().name
+            self.fh.write(EXPORT_HTML)
+            return None, True
+
+    mock_service = make_fake_drive({'folder123': [doc('file1', 'Doc 1')]})
+    mock_service.files.return_value.export_media.side_effect = lambda fileId, mimeType: mimeType
+
+    with patch('src.main.get_service', return_value=mock_service), \
+         patch('src.main.MediaIoBaseDownload', OverlapDownloader):
+        main.start_export_pool(1)
+        try:
+            assert main.convert_to_markdown(mock_service, 'file1', 'Doc 1', str(tmp_path), converter='markdownify')
+        finally:
+            main.shutdown_export_pool()
+
+    assert downloaded_on['application/pdf'].startswith('export')
+    assert downloaded_on['text/html'] == threading.current_thread().name
+
+def test_pipeline_overlaps_pdf_export_with_markdown_export(tmp_path):
+    import threading
+    both_in_flight = threading.Barrier(2, timeout=5)
+    downloaded_on = {}
+
+    class OverlapDownloader:
+        def __init__(self, fh, request):
+            self.fh, self.mime_type = fh, request
+
+        def next_chunk(self):
+            # Each export waits for the other to start; serial exports would time out
+            both_in_flight.wait()
+            downloaded_on[self.mime_type] = threading.current_thread().name
+            self.fh.write(EXPORT_MARKDOWN)
+            return None, True
+
+    mock_service = make_fake_drive({'folder123': [doc('file1', 'Doc 1')]})
+    converted_files = []
+    pipeline = main.ConversionPipeline(export_workers=1, convert_workers=1, upload_workers=1, queue_size=1)
+    with patch('src.main.get_service', return_value=mock_service), \
+         patch('src.main.MediaIoBaseDownload', OverlapDownloader), \
+         patch('src.main.save_state'):
+        main.scan_folder(mock_service, 'folder123', str(tmp_path), {}, converted_files=converted_files, pipeline=pipeline)
+        pipeline.close()
+
+    assert converted_files == [('Doc 1', 'Doc 1')]
+    assert downloaded_on['application/pdf'].startswith('pipeline-pdf')
+    assert downloaded_on['text/markdown'].startswith('pipeline-export')
 
 def test_main_workflow_custom_path_recursive(mock_state, tmp_path):
     # Custom config for this test with the new map format
@@ -160,80 +389,876 @@ def test_main_workflow_custom_path_recursive(mock_state, tmp_path):
     config_file = tmp_path / 'config_custom.yaml'
     with open(config_file, 'w') as f:
         yaml.dump(config, f)
-        
+
+    mock_service = make_fake_drive({
+        'root': [folder('drive_id', 'Drive')],
+        'drive_id': [folder('folder_id', 'Folder')],
+        'folder_id': [doc('file1', 'Doc 1'), folder('sub_id', 'Sub')],
+        'sub_id': [doc('file2', 'Doc 2')],
+    })
+    # Uploads fail, so outputs land in the local fallback directories
+    mock_service.files.return_value.create.return_value.execute.side_effect = Exception("upload failed")
+
     with patch('src.main.CONFIG_FILE', str(config_file)), \
          patch('src.main.STATE_FILE', mock_state), \
-         patch('src.main.get_service') as mock_get_service, \
-         patch('src.main.MediaIoBaseDownload') as mock_downloader_cls, \
-         patch('io.BytesIO') as mock_io_cls:
-         
-        # Mock Service
-        mock_service = MagicMock()
-        mock_get_service.return_value = mock_service
-        mock_files = mock_service.files.return_value
-        mock_list = mock_files.list
-        
-        # 1. Resolve 'Drive/Folder'
-        #    - Drive -> drive_id
-        #    - Folder -> folder_id
-        # 2. Scan 'Folder' (folder_id)
-        #    - List Docs -> 1 file
-        #    - List Subfolders -> 1 subfolder 'Sub'
-        # 3. Scan 'Sub' (sub_id)
-        #    - List Docs -> 1 file (nested)
-        #    - List Subfolders -> 0
-        
-        res_drive = {'files': [{'id': 'drive_id', 'name': 'Drive'}]}
-        res_folder = {'files': [{'id': 'folder_id', 'name': 'Folder'}]}
-        
-        scan_folder_docs = {
-            'files': [
-                {'id': 'file1', 'name': 'Doc 1', 'modifiedTime': '2023-10-26T10:00:00Z'}
-            ]
-        }
-        scan_folder_sub = {
-            'files': [
-                {'id': 'sub_id', 'name': 'Sub'}
-            ]
-        }
-        
-        scan_sub_docs = {
-             'files': [
-                {'id': 'file2', 'name': 'Doc 2', 'modifiedTime': '2023-10-26T10:00:00Z'}
-            ]
-        }
-        scan_sub_folders = {'files': []}
-        
-        mock_list.return_value.execute.side_effect = [
-            res_drive,
-            res_folder,
-            scan_folder_docs,
-            scan_folder_sub,
-            scan_sub_docs,
-            scan_sub_folders
-        ]
-        
-        # Mock Download
-        mock_downloader_instance = MagicMock()
-        mock_downloader_cls.return_value = mock_downloader_instance
-        mock_downloader_instance.next_chunk.side_effect = [(None, True)] * 4
-        
-        # Mock io.BytesIO
-        mock_buffer = MagicMock()
-        mock_buffer.getvalue.return_value = b"<h1>Title</h1><p>Content</p>"
-        mock_io_cls.return_value = mock_buffer
-        
-        # Run main
+         patch('src.main.get_service', return_value=mock_service), \
+         patch('src.main.MediaIoBaseDownload', FakeDownloader):
+
         main.main(dry_run=False)
-        
-        # Verify files created
-        output_dir_1 = tmp_path / 'custom_output'
-        assert (output_dir_1 / 'Doc 1.md').exists()
-        assert (output_dir_1 / 'Doc 1.pdf').exists()
-        
-        output_dir_2 = tmp_path / 'custom_output' / 'Sub'
-        assert (output_dir_2 / 'Doc 2.md').exists()
-        assert (output_dir_2 / 'Doc 2.pdf').exists()
+
+    # Verify files created
+    output_dir_1 = tmp_path / 'custom_output'
+    assert (output_dir_1 / 'Doc 1.md').exists()
+    assert (output_dir_1 / 'Doc 1.pdf').exists()
+
+    output_dir_2 = tmp_path / 'custom_output' / 'Sub'
+    assert (output_dir_2 / 'Doc 2.md').exists()
+    assert (output_dir_2 / 'Doc 2.pdf').exists()
+    assert (output_dir_2 / 'Doc 2.md').read_text() == "# Title\n\nContent"
+
+def test_scan_folder_uses_one_listing_per_folder(tmp_path):
+    """Existing outputs are found in the folder listing instead of per-doc queries."""
+    mock_service = make_fake_drive({
+        'folder123': [
+            doc('file1', 'Doc 1'),
+            {'id': 'md1', 'name': 'Doc 1.md', 'mimeType': 'text/markdown'},
+            {'id': 'pdf1', 'name': 'Doc 1.pdf', 'mimeType': 'application/pdf'},
+            doc('file2', 'Doc 2'),
+        ],
+    })
+    mock_files = mock_service.files.return_value
+    state = {'file1': '2023-10-26T10:00:00Z', 'file2': '2023-10-26T10:00:00Z'}
+    converted_files = []
+
+    with patch('src.main.MediaIoBaseDownload', FakeDownloader), \
+         patch('src.main.save_state'):
+        main.scan_folder(mock_service, 'folder123', str(tmp_path), state, converted_files=converted_files)
+
+    # Doc 1 is unchanged with both outputs present; Doc 2 is missing its outputs
+    assert converted_files == [('Doc 2', 'Doc 2')]
+    assert mock_files.list.call_count == 1
+    assert mock_files.export_media.call_count == 2
+
+def test_incremental_converts_only_changed_docs_under_roots(mock_config, mock_state, tmp_path):
+    mock_service = make_fake_drive({
+        'root': [folder('path_id', 'Path'), folder('elsewhere', 'Elsewhere')],
+        'path_id': [folder('to_id', 'To')],
+        'to_id': [folder('folder_id', 'Folder')],
+        'folder_id': [folder('sub_id', 'Sub')],
+        'sub_id': [doc('file3', 'Doc 3', '2023-10-27T09:00:00Z')],
+        'folder123': [doc('file1', 'Doc 1', '2023-10-26T10:00:00Z')],
+        'elsewhere': [doc('file9', 'Doc 9', '2023-10-27T09:00:00Z')],
+    })
+    mock_files = mock_service.files.return_value
+    mock_service.changes.return_value.list.return_value.execute.side_effect = [
+        {'changes': [
+            {'fileId': 'file3', 'file': dict(doc('file3', 'Doc 3', '2023-10-27T09:00:00Z'), parents=['sub_id'])},
+        ], 'nextPageToken': 'tok2'},
+        {'changes': [
+            {'fileId': 'file9', 'file': dict(doc('file9', 'Doc 9', '2023-10-27T09:00:00Z'), parents=['elsewhere'])},
+            {'fileId': 'gone', 'removed': True},
+        ], 'newStartPageToken': 'tok3'},
+    ]
+    with open(mock_state, 'w') as f:
+        json.dump({'_changes_page_token': 'tok1', 'file1': '2023-10-26T10:00:00Z'}, f)
+
+    converted_files = []
+    with patch('src.main.CONFIG_FILE', mock_config), \
+         patch('src.main.STATE_FILE', mock_state), \
+         patch('os.getcwd', return_value=str(tmp_path)), \
+         patch('src.main.get_service', return_value=mock_service), \
+         patch('src.main.MediaIoBaseDownload', FakeDownloader), \
+         patch('src.main.print_conversion_report') as mock_report:
+
+        main.main(dry_run=False, incremental=True)
+        converted_files = mock_report.call_args.args[0]
+
+    # Only the changed doc under a configured root was converted, with its folder path
+    assert converted_files == [('Sub/Doc 3', 'Doc 3')]
+    assert mock_files.export_media.call_count == 2
+    listed = [c.kwargs['q'] for c in mock_files.list.call_args_list]
+    assert not any("'folder123' in parents" in q for q in listed)
+    assert mock_service.changes.return_value.list.call_args_list[0].kwargs['pageToken'] == 'tok1'
+
+    state = read_state(mock_state)
+    assert state['_changes_page_token'] == 'tok3'
+    assert state['file3']['modifiedTime'] == '2023-10-27T09:00:00Z'
+
+def test_incremental_retries_docs_that_failed(mock_config, mock_state, tmp_path):
+    mock_service = make_fake_drive({
+        'root': [folder('path_id', 'Path')],
+        'path_id': [folder('to_id', 'To')],
+        'to_id': [folder('folder_id', 'Folder')],
+        'folder_id': [doc('file3', 'Doc 3', '2023-10-27T09:00:00Z')],
+        'folder123': [],
+    })
+    mock_files = mock_service.files.return_value
+    mock_service.changes.return_value.list.return_value.execute.side_effect = [
+        {'changes': [{'fileId': 'file3', 'file': dict(doc('file3', 'Doc 3', '2023-10-27T09:00:00Z'), parents=['folder_id'])}],
+         'newStartPageToken': 'tok2'},
+        # Doc 3 is not edited again before the next run
+        {'changes': [], 'newStartPageToken': 'tok3'},
+    ]
+    with open(mock_state, 'w') as f:
+        json.dump({'_changes_page_token': 'tok1'}, f)
+    export_fails = [True]
+
+    def export_side_effect(fileId, mimeType):
+        if export_fails[0]:
+            raise Exception("export failed")
+        return mimeType
+    mock_files.export_media.side_effect = export_side_effect
+
+    with patch('src.main.CONFIG_FILE', mock_config), \
+         patch('src.main.STATE_FILE', mock_state), \
+         patch('os.getcwd', return_value=str(tmp_path)), \
+         patch('src.main.get_service', return_value=mock_service), \
+         patch('src.main.MediaIoBaseDownload', FakeDownloader):
+        main.main(dry_run=False, incremental=True)
+        state = read_state(mock_state)
+        # The token moves on, and the failed doc is remembered
+        assert state['_changes_page_token'] == 'tok2'
+        assert state['_failed_docs'] == ['file3']
+        assert 'file3' not in state
+
+        export_fails[0] = False
+        main.main(dry_run=False, incremental=True)
+
+    state = read_state(mock_state)
+    assert state['_changes_page_token'] == 'tok3'
+    assert state['_failed_docs'] == []
+    assert state['file3']['modifiedTime'] == '2023-10-27T09:00:00Z'
+
+def test_incremental_first_run_records_start_token(mock_config, mock_state, tmp_path):
+    mock_service = make_fake_drive({'folder123': [], 'root': [folder('path_id', 'Path')]})
+    mock_service.changes.return_value.getStartPageToken.return_value.execute.return_value = {'startPageToken': 'start1'}
+
+    with patch('src.main.CONFIG_FILE', mock_config), \
+         patch('src.main.STATE_FILE', mock_state), \
+         patch('os.getcwd', return_value=str(tmp_path)), \
+         patch('src.main.get_service', return_value=mock_service):
+
+        main.main(dry_run=False, incremental=True)
+
+    # Without a token a full scan runs and the token is recorded for next time
+    assert mock_service.changes.return_value.list.call_count == 0
+    assert read_state(mock_state)['_changes_page_token'] == 'start1'
+
+def test_sqlite_state_migrates_json_and_upserts(mock_state):
+    with open(mock_state, 'w') as f:
+        json.dump({'file1': '2023-10-26T10:00:00Z', 'file2': '2023-10-26T11:00:00Z'}, f)
+
+    with patch('src.main.STATE_FILE', mock_state):
+        state = main.load_state()
+        assert dict(state) == {'file1': '2023-10-26T10:00:00Z', 'file2': '2023-10-26T11:00:00Z'}
+        # The JSON file is moved aside so the migration only happens once
+        assert not os.path.exists(mock_state)
+        assert os.path.exists(mock_state + '.migrated')
+
+        state['file2'] = '2023-10-27T09:00:00Z'
+        state['file3'] = '2023-10-27T10:00:00Z'
+        del state['file1']
+        main.save_state(state)
+        # Only the touched keys are written
+        assert not state._dirty and not state._deleted
+        main.close_state(state)
+
+    assert read_state(mock_state) == {'file2': '2023-10-27T09:00:00Z', 'file3': '2023-10-27T10:00:00Z'}
+
+def test_json_state_backend(mock_state):
+    with patch('src.main.STATE_FILE', mock_state):
+        state = main.load_state('json')
+        state['file1'] = '2023-10-26T10:00:00Z'
+        main.save_state(state)
+        main.close_state(state)
+    with open(mock_state, 'r') as f:
+        assert json.load(f) == {'file1': '2023-10-26T10:00:00Z'}
+
+def test_upload_skipped_when_md5_matches(tmp_path):
+    import hashlib
+    md_bytes = b"# Title\n\nContent"
+    mock_service = make_fake_drive({
+        'folder123': [
+            doc('file1', 'Doc 1', '2023-10-27T09:00:00Z'),
+            {'id': 'md1', 'name': 'Doc 1.md', 'mimeType': 'text/markdown', 'md5Checksum': hashlib.md5(md_bytes).hexdigest()},
+            {'id': 'pdf1', 'name': 'Doc 1.pdf', 'mimeType': 'application/pdf', 'md5Checksum': 'stale'},
+        ],
+    })
+    mock_files = mock_service.files.return_value
+    # modifiedTime moved on, so the doc is re-exported
+    state = {'file1': '2023-10-26T10:00:00Z'}
+    main.RUN_STATS.clear()
+
+    with patch('src.main.MediaIoBaseDownload', FakeDownloader), \
+         patch('src.main.save_state'):
+        main.scan_folder(mock_service, 'folder123', str(tmp_path), state, converted_files=[])
+
+    # Markdown is byte-identical and skipped; the PDF changed and is updated
+    assert "md5Checksum" in mock_files.list.call_args_list[0].kwargs['fields']
+    assert [c.kwargs['fileId'] for c in mock_files.update.call_args_list] == ['pdf1']
+    assert mock_files.create.call_count == 0
+    assert main.RUN_STATS['uploads_skipped_unchanged'] == 1
+
+def test_html_probe_skips_pdf_export_when_content_unchanged(tmp_path):
+    mock_service = make_fake_drive({
+        'folder123': [
+            doc('file1', 'Doc 1', '2023-10-27T09:00:00Z'),
+            {'id': 'md1', 'name': 'Doc 1.md', 'mimeType': 'text/markdown'},
+            {'id': 'pdf1', 'name': 'Doc 1.pdf', 'mimeType': 'application/pdf'},
+        ],
+    })
+    mock_files = mock_service.files.return_value
+    mock_files.export_media.side_effect = lambda fileId, mimeType: mimeType
+
+    class VolatileDownloader:
+        """Each export carries freshly generated heading ids and anchors."""
+        exports = 0
+
+        def __init__(self, fh, request):
+            VolatileDownloader.exports += 1
+            n = VolatileDownloader.exports
+            fh.write(f'<h1 id="h.gen{n}"><a id="kix.{n}"></a>Title</h1><p><a href="#h.gen{n}">Content</a></p>'.encode())
+
+        def next_chunk(self):
+            return None, True
+
+    baseline = main.html_content_hash('<h1 id="h.old"><a id="kix.old"></a>Title</h1><p><a href="#h.old">Content</a></p>')
+    state = {'file1': {'modifiedTime': '2023-10-26T10:00:00Z', 'contentHash': baseline}}
+    converted_files = []
+    main.RUN_STATS.clear()
+
+    with patch('src.main.MediaIoBaseDownload', VolatileDownloader), \
+         patch('src.main._converter', 'markdownify'), \
+         patch('src.main.save_state'):
+        main.scan_folder(mock_service, 'folder123', str(tmp_path), state, converted_files=converted_files)
+
+    # Only the HTML probe ran; no PDF export, no uploads, nothing reported as converted
+    assert [c.kwargs['mimeType'] for c in mock_files.export_media.call_args_list] == ['text/html']
+    assert mock_files.update.call_count == 0 and mock_files.create.call_count == 0
+    assert converted_files == []
+    assert main.RUN_STATS['docs_unchanged_by_probe'] == 1
+    # The new modifiedTime is recorded so the doc is not probed again
+    assert state['file1'] == {'modifiedTime': '2023-10-27T09:00:00Z', 'contentHash': baseline}
+
+def test_native_markdown_export_falls_back_to_markdownify(tmp_path):
+    mock_service = make_fake_drive({'folder123': [doc('file1', 'Doc 1'), doc('file2', 'Doc 2')]})
+    mock_files = mock_service.files.return_value
+    plain_export = mock_files.export_media.side_effect
+
+    def export_media(fileId, mimeType):
+        if fileId == 'file2' and mimeType == 'text/markdown':
+            request = MagicMock()
+            request.execute.side_effect = http_error(400, 'badRequest')
+            return request
+        return plain_export(fileId=fileId, mimeType=mimeType)
+    mock_files.export_media.side_effect = export_media
+
+    class RequestDownloader(FakeDownloader):
+        def __init__(self, fh, request):
+            if not isinstance(request, str):
+                request.execute()
+            super().__init__(fh, request)
+
+    main.RUN_STATS.clear()
+    with patch('src.main.MediaIoBaseDownload', RequestDownloader), \
+         patch('src.main.save_state'):
+        main.scan_folder(mock_service, 'folder123', str(tmp_path), {}, converted_files=[])
+
+    exported = [(c.kwargs['fileId'], c.kwargs['mimeType']) for c in mock_files.export_media.call_args_list]
+    assert ('file1', 'text/html') not in exported
+    assert ('file2', 'text/html') in exported
+    uploads = {c.kwargs['body']['name']: c.kwargs['media_body'] for c in mock_files.create.call_args_list}
+    assert uploads['Doc 1.md'].getbytes(0, 100) == EXPORT_MARKDOWN
+    assert uploads['Doc 2.md'].getbytes(0, 100) == b"# Title\n\nContent"
+    assert main.RUN_STATS['native_export_fallbacks'] == 1
+
+def test_streaming_converter_handles_google_docs_html():
+    html = (
+        '<html><head><style type="text/css">.lst-kix_ab-0>li:before{content:"\\0025cf  "}'
+        '.c1{font-weight:700}.c2{font-style:italic}.c3{font-weight:400}</style><title>Doc</title></head><body>'
+        '<h2 id="h.x1"><span class="c3">Plan</span></h2>'
+        '<p><span class="c3">Read </span><span class="c1">this </span><span class="c2">now</span><span class="c3">&nbsp;at '
+        '</span><span class="c3"><a href="https://www.google.com/url?q=https://example.com/doc&amp;sa=D&amp;ust=1">the_site</a></span></p>'
+        '<ul class="lst-kix_ab-0 start"><li class="li-bullet-0"><span>one</span></li></ul>'
+        '<ul class="lst-kix_ab-1 start"><li class="li-bullet-0"><span>nested</span></li></ul>'
+        '<table><tr><td><p>k</p></td><td><p>v</p></td></tr><tr><td><p>a|b</p></td><td><p>c</p></td></tr></table>'
+        '</body></html>'
+    )
+
+    assert main.streaming_markdown(html) == (
+        "## Plan\n\n"
+        "Read **this** *now* at [the\\_site](https://example.com/doc)\n\n"
+        "- one\n"
+        "    - nested\n\n"
+        "| k | v |\n| --- | --- |\n| a\\|b | c |"
+    )
+
+def test_streaming_converter_emits_blocks_as_it_goes():
+    written = []
+    parser = main.DocsMarkdownParser(written.append)
+    parser.feed('<p>first</p><p>sec')
+    # The first paragraph is out before the document has been fully read
+    assert written == ['first']
+    parser.feed('ond</p>')
+    parser.close()
+    assert ''.join(written) == "first\n\nsecond"
+
+def test_conversion_pool_converts_in_worker_processes():
+    pool = main.ConversionPool(1, timeout=60)
+    try:
+        assert pool.convert('markdownify', EXPORT_HTML.decode('utf-8')) == "# Title\n\nContent"
+        # Large exports travel through shared memory instead of the task pipe
+        with patch('src.main.SHARED_MEMORY_THRESHOLD', 0):
+            assert pool.convert('streaming', EXPORT_HTML.decode('utf-8')) == "# Title\n\nContent"
+    finally:
+        pool.close()
+
+def test_conversion_pool_kills_slow_conversions():
+    main.RUN_STATS.clear()
+    pool = main.ConversionPool(1, timeout=0.2)
+    try:
+        slow_html = "<p>" + "<b>x</b> " * 200000 + "</p>"
+        first = pool.pool
+        with pytest.raises(main.ConversionTimeout):
+            pool.convert('markdownify', slow_html)
+        # The stuck worker was replaced and the next doc converts normally
+        assert pool.pool is not first
+        pool.timeout = 60
+        assert pool.convert('markdownify', EXPORT_HTML.decode('utf-8')) == "# Title\n\nContent"
+        assert main.RUN_STATS['conversions_timed_out'] == 1
+    finally:
+        pool.close()
+
+def test_benchmark_compares_converters(tmp_path):
+    corpus = tmp_path / 'corpus.txt'
+    corpus.write_text("# fixture docs\nfile1\n\nfile2  # long one\n")
+    mock_service = make_fake_drive({'folder123': [doc('file1', 'Doc 1'), doc('file2', 'Doc 2')]})
+
+    with patch('src.main.MediaIoBaseDownload', FakeDownloader):
+        results = main.benchmark_converters(mock_service, main.load_benchmark_corpus(str(corpus)))
+
+    assert set(results) == set(main.CONVERTERS)
+    for name, stats in results.items():
+        assert stats['docs'] == 2 and stats['failures'] == 0
+        assert stats['bytes'] == 2 * len(EXPORT_MARKDOWN)
+        # The canned HTML converts to exactly the canned native markdown
+        assert stats['similarity'] == 1.0
+    assert mock_service.files.return_value.export_media.call_count == 2 * len(main.CONVERTERS)
+
+def test_deleted_listed_output_falls_back_to_a_folder_search(tmp_path):
+    import httplib2
+    from googleapiclient.errors import HttpError
+
+    folder = [
+        doc('file1', 'Doc 1', '2023-10-27T09:00:00Z'),
+        {'id': 'md1', 'name': 'Doc 1.md', 'mimeType': 'text/markdown'},
+        {'id': 'pdf1', 'name': 'Doc 1.pdf', 'mimeType': 'application/pdf'},
+    ]
+    mock_service = make_fake_drive({'folder123': folder})
+    mock_files = mock_service.files.return_value
+
+    def update_side_effect(fileId=None, **kwargs):
+        request = MagicMock()
+        if fileId == 'pdf1':
+            # The PDF was deleted and recreated by hand after the folder was listed
+            folder[2] = {'id': 'pdf2', 'name': 'Doc 1.pdf', 'mimeType': 'application/pdf'}
+            request.execute.side_effect = HttpError(httplib2.Response({'status': 404}), b'File not found')
+        else:
+            request.execute.return_value = {'id': fileId}
+        return request
+    mock_files.update.side_effect = update_side_effect
+
+    state = {'file1': {'modifiedTime': '2023-10-26T10:00:00Z', 'contentHash': None}}
+    with patch('src.main.MediaIoBaseDownload', FakeDownloader), \
+         patch('src.main.save_state'):
+        main.scan_folder(mock_service, 'folder123', str(tmp_path), state, converted_files=[])
+
+    # md is updated from the listing; the listed PDF 404s, so the folder is
+    # searched and the file now holding the name is updated instead
+    assert [c.kwargs['fileId'] for c in mock_files.update.call_args_list] == ['md1', 'pdf1', 'pdf2']
+    assert mock_files.create.call_count == 0
+    assert mock_files.get.call_count == 0
+    assert set(state['file1']) == {'modifiedTime', 'contentHash'}
+
+def http_error(status, reason=None, headers=None):
+    import httplib2
+    from googleapiclient.errors import HttpError
+    body = json.dumps({'error': {'errors': [{'reason': reason}]}}).encode() if reason else b''
+    return HttpError(httplib2.Response(dict(headers or {}, status=status)), body)
+
+def test_execute_request_retries_transient_errors():
+    request = MagicMock()
+    request.execute.side_effect = [
+        http_error(503),
+        http_error(403, 'userRateLimitExceeded', {'retry-after': '7'}),
+        {'id': 'ok'},
+    ]
+    main.RUN_STATS.clear()
+
+    with patch('src.main.time.sleep') as mock_sleep:
+        assert main.execute_request(request) == {'id': 'ok'}
+
+    assert main.RUN_STATS['retries'] == 2
+    delays = [c.args[0] for c in mock_sleep.call_args_list]
+    assert 0 <= delays[0] <= main.RETRY_BASE_DELAY
+    # Retry-After is honoured as a floor
+    assert delays[1] >= 7
+
+def test_execute_request_does_not_retry_permanent_errors():
+    request = MagicMock()
+    request.execute.side_effect = http_error(403, 'insufficientFilePermissions')
+
+    with patch('src.main.time.sleep') as mock_sleep, pytest.raises(Exception):
+        main.execute_request(request)
+    assert request.execute.call_count == 1
+    assert mock_sleep.call_count == 0
+
+def test_retry_budget_is_shared_per_run():
+    request = MagicMock()
+    request.execute.side_effect = http_error(500)
+    main.RUN_STATS.clear()
+
+    with patch('src.main.RETRY_BUDGET', 3), patch('src.main.time.sleep'), pytest.raises(Exception):
+        main.execute_request(request)
+
+    assert request.execute.call_count == 4
+    assert main.RUN_STATS['retries'] == 3
+    assert main.RUN_STATS['retries_denied'] == 1
+
+def test_session_transport_pools_and_compresses():
+    from googleapiclient.discovery import build
+    creds = MagicMock(valid=True, token='t', universe_domain='googleapis.com')
+    transport = main.SessionTransport(creds, pool_size=7)
+    response = MagicMock(status_code=200, reason='OK', content=b'{"files": [{"id": "f1"}]}',
+                         headers={'Content-Type': 'application/json', 'Content-Encoding': 'gzip'})
+
+    with patch.object(transport._session, 'request', return_value=response) as mock_request:
+        service = build('drive', 'v3', http=transport)
+        result = service.files().list(q="'root' in parents").execute()
+
+    assert result['files'][0]['id'] == 'f1'
+    headers = mock_request.call_args.kwargs['headers']
+    assert headers['accept-encoding'] == 'gzip'
+    assert 'gzip' in headers['user-agent']
+    assert transport._session.get_adapter('https://www.googleapis.com')._pool_maxsize == 7
+    transport.close()
+
+def test_shared_transport_service_is_built_once():
+    creds = MagicMock(valid=True, token='t', universe_domain='googleapis.com')
+    main.drive_discovery_document.cache_clear()
+
+    with patch('src.main._transport', 'requests'), patch('src.main._shared_service', None), \
+         patch('src.main._shared_transport', None), \
+         patch('src.main.get_credentials', return_value=creds) as mock_credentials, \
+         patch('src.main.discovery_cache.get_static_doc', wraps=main.discovery_cache.get_static_doc) as mock_doc, \
+         patch('src.main.build') as mock_build:
+        try:
+            services = {id(main.get_service()) for _ in range(4)}
+        finally:
+            main.shutdown_shared_transport()
+
+    assert len(services) == 1
+    assert mock_credentials.call_count == 1
+    # Built offline from the bundled discovery document, read once
+    assert mock_doc.call_count == 1
+    assert mock_build.call_count == 0
+
+def test_session_transport_downloads_gzip_exports():
+    import gzip
+    import requests
+    import urllib3
+    from googleapiclient.discovery import build
+    from googleapiclient.http import MediaIoBaseDownload
+    creds = MagicMock(valid=True, token='t', universe_domain='googleapis.com')
+    transport = main.SessionTransport(creds)
+    body = b"# Title\n\n" + b"Content " * 100
+    compressed = gzip.compress(body)
+
+    def send(request, **kwargs):
+        # A real gzip response: requests decodes it but keeps the compressed length
+        response = requests.Response()
+        response.status_code = 200
+        response.headers.update({'Content-Encoding': 'gzip', 'Content-Length': str(len(compressed))})
+        response.raw = urllib3.HTTPResponse(body=io.BytesIO(compressed), headers=response.headers, preload_content=False)
+        response.request = request
+        response.url = request.url
+        return response
+
+    with patch.object(transport._session.get_adapter('https://www.googleapis.com'), 'send', side_effect=send) as mock_send:
+        service = build('drive', 'v3', http=transport)
+        fh = io.BytesIO()
+        downloader = MediaIoBaseDownload(fh, service.files().export_media(fileId='doc1', mimeType='text/markdown'))
+        for _ in range(3):
+            _, done = downloader.next_chunk()
+            if done:
+                break
+    transport.close()
+
+    # The download completes with the decoded size, not the compressed one
+    assert done
+    assert fh.getvalue() == body
+    assert mock_send.call_count == 1
+
+def test_drive_services_built_on_threads_do_not_share_descriptions():
+    from concurrent.futures import ThreadPoolExecutor
+    from google.oauth2.credentials import Credentials
+    creds = Credentials(token='t')
+
+    def build_and_list(i):
+        service = main.build_drive_service(credentials=creds)
+        return service.files().list(q=f"'folder{i}' in parents", supportsAllDrives=True).uri
+
+    with ThreadPoolExecutor(8) as pool:
+        uris = list(pool.map(build_and_list, range(32)))
+
+    assert all(f"folder{i}" in uri for i, uri in enumerate(uris))
+    # The memoised document is never handed out for build_from_document to fill in
+    assert isinstance(main.drive_discovery_document(), str)
+
+def test_http2_transport_serves_drive_calls_from_any_thread():
+    httpx = pytest.importorskip('httpx')
+    from concurrent.futures import ThreadPoolExecutor
+    from googleapiclient.discovery import build
+    seen = []
+
+    def handler(request):
+        seen.append(request)
+        if request.headers['authorization'] == 'Bearer stale':
+            return httpx.Response(401)
+        return httpx.Response(200, json={'files': [{'id': 'f1', 'name': 'Doc'}]})
+
+    creds = MagicMock(valid=True, token='stale', universe_domain='googleapis.com')
+    creds.apply.side_effect = lambda headers: headers.__setitem__('authorization', f'Bearer {creds.token}')
+    creds.refresh.side_effect = lambda request: setattr(creds, 'token', 'fresh')
+    transport = main.Http2Transport(creds, transport=httpx.MockTransport(handler))
+    try:
+        service = build('drive', 'v3', http=transport)
+        with ThreadPoolExecutor(4) as pool:
+            results = list(pool.map(lambda _: service.files().list(q="'root' in parents").execute(), range(8)))
+    finally:
+        transport.close()
+
+    assert all(r['files'][0]['id'] == 'f1' for r in results)
+    # The stale token is refreshed once and then reused by every thread
+    assert creds.refresh.call_count == 1
+    assert sum(r.headers['authorization'] == 'Bearer fresh' for r in seen) == 8
+
+def test_http2_transport_needs_httpx():
+    with patch.dict('sys.modules', {'httpx': None}), patch('src.main._transport', 'http2'), \
+         patch('src.main._shared_service', None), patch('src.main.get_credentials'):
+        assert main.get_service() is None
+
+def test_adaptive_limiter_aimd():
+    limiter = main.AdaptiveLimiter('metadata', rate=1000.0, burst=1000, max_concurrency=8, initial_concurrency=4)
+
+    # Additive increase: roughly one extra slot per `limit` successful calls
+    for _ in range(5):
+        limiter.acquire()
+        limiter.release()
+    assert int(limiter.limit) == 5
+
+    # Multiplicative decrease on throttling, never below one
+    limiter.acquire()
+    limiter.release(throttled=True)
+    assert int(limiter.limit) == 2
+    for _ in range(3):
+        limiter.acquire()
+        limiter.release(throttled=True)
+    assert limiter.limit == 1.0
+
+def test_adaptive_limiter_caps_in_flight_calls():
+    import threading
+    limiter = main.AdaptiveLimiter('export', rate=1000.0, burst=1000, max_concurrency=2, initial_concurrency=2)
+    limiter.acquire()
+    limiter.acquire()
+
+    third = threading.Thread(target=limiter.acquire)
+    third.start()
+    third.join(0.1)
+    # The third call waits until one of the first two finishes
+    assert third.is_alive()
+    limiter.release()
+    third.join(1)
+    assert not third.is_alive()
+    assert limiter.in_flight == 2
+
+def test_throttled_call_halves_concurrency(fresh_limiters):
+    request = MagicMock()
+    request.execute.side_effect = [http_error(429), {'id': 'ok'}]
+    main.RUN_STATS.clear()
+
+    with patch('src.main.time.sleep'):
+        main.execute_request(request, kind='upload')
+
+    assert int(fresh_limiters['upload'].limit) == main.INITIAL_CONCURRENCY // 2
+    assert main.RUN_STATS['throttled'] == 1
+    assert fresh_limiters['upload'].in_flight == 0
+
+def test_breadth_first_crawl_visits_each_folder_once(tmp_path):
+    shortcut = {'id': 'sc1', 'name': 'Back to top', 'mimeType': main.SHORTCUT_MIME_TYPE,
+                'shortcutDetails': {'targetId': 'folder123', 'targetMimeType': main.FOLDER_MIME_TYPE}}
+    to_shared = {'id': 'sc2', 'name': 'Shared link', 'mimeType': main.SHORTCUT_MIME_TYPE,
+                 'shortcutDetails': {'targetId': 'shared_id', 'targetMimeType': main.FOLDER_MIME_TYPE}}
+    drive = {
+        'folder123': [folder(f'wide{i}', f'Wide {i}') for i in range(20)] + [doc('file0', 'Doc 0'), to_shared],
+        'wide3': [folder('shared_id', 'Shared'), shortcut],
+        'shared_id': [doc('file1', 'Doc 1')],
+    }
+    mock_service = make_fake_drive(drive)
+    mock_files = mock_service.files.return_value
+    converted_files = []
+
+    with patch('src.main.get_service', return_value=mock_service), \
+         patch('src.main.MediaIoBaseDownload', FakeDownloader), \
+         patch('src.main.save_state'):
+        main.scan_folder(mock_service, 'folder123', str(tmp_path), {}, converted_files=converted_files, listers=4)
+
+    listed = [re.search(r"'([^']+)' in parents", c.kwargs['q']).group(1)
+              for c in mock_files.list.call_args_list if "' in parents and trashed" in c.kwargs['q'] and 'name =' not in c.kwargs['q']]
+    # Every folder is listed exactly once despite the shortcut cycle and the second route to Shared
+    assert sorted(listed) == sorted(['folder123', 'shared_id'] + [f'wide{i}' for i in range(20)])
+    assert sorted(name for _, name in converted_files) == ['Doc 0', 'Doc 1']
+
+def test_overlapping_roots_are_scanned_once(mock_state, tmp_path):
+    config = {
+        'directories': [
+            {'Team/Eng': str(tmp_path / 'eng')},
+            {'Team/Eng/Notes': str(tmp_path / 'notes')},
+            {'Team/Ops': str(tmp_path / 'ops')},
+        ]
+    }
+    config_file = tmp_path / 'config_overlap.yaml'
+    with open(config_file, 'w') as f:
+        yaml.dump(config, f)
+
+    mock_service = make_fake_drive({
+        'root': [folder('team_id', 'Team')],
+        'team_id': [folder('eng_id', 'Eng'), folder('ops_id', 'Ops')],
+        'eng_id': [doc('file1', 'Doc 1'), folder('notes_id', 'Notes')],
+        'notes_id': [doc('file2', 'Doc 2')],
+        'ops_id': [doc('file3', 'Doc 3')],
+    })
+    mock_files = mock_service.files.return_value
+    mock_files.create.return_value.execute.side_effect = Exception("upload failed")
+
+    with patch('src.main.CONFIG_FILE', str(config_file)), \
+         patch('src.main.STATE_FILE', mock_state), \
+         patch('src.main.get_service', return_value=mock_service), \
+         patch('src.main.MediaIoBaseDownload', FakeDownloader):
+        main.main(dry_run=False, list_workers=3)
+
+    queries = [c.kwargs['q'] for c in mock_files.list.call_args_list]
+    # The shared Team prefix is resolved once for all three paths
+    assert sum("name = 'Team'" in q for q in queries) == 1
+    listed = [re.search(r"'([^']+)' in parents", q).group(1) for q in queries if 'name =' not in q]
+    # Notes lies inside Eng but is listed once, under its own config
+    assert sorted(listed) == ['eng_id', 'notes_id', 'ops_id']
+    assert (tmp_path / 'eng' / 'Doc 1.md').exists()
+    assert (tmp_path / 'notes' / 'Doc 2.md').exists()
+    assert not (tmp_path / 'eng' / 'Notes' / 'Doc 2.md').exists()
+    assert (tmp_path / 'ops' / 'Doc 3.md').exists()
+
+def test_my_drive_id_is_looked_up_once_per_run(tmp_path, mock_state):
+    config_file = tmp_path / 'config_my_drive.yaml'
+    with open(config_file, 'w') as f:
+        yaml.dump({'directories': ['/', 'Team']}, f)
+    mock_service = make_fake_drive({
+        'root': [folder('team_id', 'Team'), doc('file1', 'Doc 1')],
+        'team_id': [doc('file2', 'Doc 2')],
+    })
+    mock_files = mock_service.files.return_value
+    mock_service.changes.return_value.getStartPageToken.return_value.execute.return_value = {'startPageToken': 't1'}
+
+    with patch('src.main.CONFIG_FILE', str(config_file)), \
+         patch('src.main.STATE_FILE', mock_state), \
+         patch('os.getcwd', return_value=str(tmp_path)), \
+         patch('src.main.get_service', return_value=mock_service), \
+         patch('src.main.MediaIoBaseDownload', FakeDownloader):
+        main.main(dry_run=False, traversal='tree', incremental=True)
+
+    assert [c.kwargs for c in mock_files.get.call_args_list].count({'fileId': 'root', 'fields': 'id', 'supportsAllDrives': True}) == 1
+    # Team is inside My Drive but its doc is converted once
+    assert sorted(c.kwargs['body']['name'] for c in mock_files.create.call_args_list) == \
+        ['Doc 1.md', 'Doc 1.pdf', 'Doc 2.md', 'Doc 2.pdf']
+
+def test_nested_roots_configured_by_id_are_detected():
+    mock_service = make_fake_drive({
+        'my_drive': [folder('outer', 'Outer')],
+        'outer': [folder('between', 'Between')],
+        'between': [folder('mid', 'Mid')],
+        'mid': [folder('inner', 'Inner')],
+        'elsewhere': [folder('other', 'Other')],
+    })
+    roots = [{'id': root_id, 'name': root_id, 'local_dir': root_id} for root_id in ('inner', 'other', 'outer', 'mid')]
+
+    nested = main.find_nested_roots(mock_service, roots, main.DriveTree())
+
+    assert sorted((inner['id'], outer['id']) for inner, outer in nested) == [('inner', 'mid'), ('mid', 'outer')]
+    # The roots, then one batch per level of missing ancestors
+    assert mock_service.new_batch_http_request.call_count <= 4
+
+def test_scan_folder_needs_no_parent_lookups(tmp_path):
+    shared = dict(doc('file3', 'Doc 3'), parents=['elsewhere', 'folder123'])
+    mock_service = make_fake_drive({
+        'folder123': [doc('file1', 'Doc 1'), doc('file2', 'Doc 2'), shared],
+    })
+    mock_files = mock_service.files.return_value
+    tree = main.DriveTree()
+
+    with patch('src.main.MediaIoBaseDownload', FakeDownloader), \
+         patch('src.main.save_state'):
+        main.scan_folder(mock_service, 'folder123', str(tmp_path), {}, converted_files=[], tree=tree)
+
+    # The listed folder is the parent; outputs go next to the doc where it was found
+    assert mock_service.new_batch_http_request.call_count == 0
+    assert mock_files.get.call_count == 0
+    assert mock_files.create.call_count == 6
+    assert all(c.kwargs['body']['parents'] == ['folder123'] for c in mock_files.create.call_args_list)
+    assert 'parents' in mock_files.list.call_args.kwargs['fields']
+    assert tree.parent_id('file3') == 'folder123'
+    assert tree.find_child('elsewhere', 'Doc 3').id == 'file3'
+
+def test_batch_get_files_splits_and_retries_per_callback():
+    mock_service = make_fake_drive({'folder123': [doc(f'file{i}', f'Doc {i}') for i in range(150)]})
+    mock_files = mock_service.files.return_value
+    plain_get = mock_files.get.side_effect
+    failed_once = set()
+
+    def flaky_get(fileId=None, **kwargs):
+        if fileId in ('file7', 'file8') and fileId not in failed_once:
+            failed_once.add(fileId)
+            request = MagicMock()
+            error = http_error(403, 'userRateLimitExceeded') if fileId == 'file7' else http_error(404)
+            request.execute.side_effect = error
+            return request
+        return plain_get(fileId=fileId, **kwargs)
+    mock_files.get.side_effect = flaky_get
+
+    with patch('src.main.time.sleep'):
+        results = main.batch_get_files(mock_service, [f'file{i}' for i in range(150)], 'id, parents')
+
+    assert mock_service.new_batch_http_request.call_count == 2
+    # The rate-limited lookup is retried on its own; the 404 is dropped
+    assert 'file7' in results and 'file8' not in results
+    assert len(results) == 149
+
+def test_tree_traversal_uses_one_enumeration(mock_state, tmp_path):
+    config = {'directories': [{'name': 'Test Folder', 'id': 'folder123'}]}
+    config_file = tmp_path / 'config.yaml'
+    with open(config_file, 'w') as f:
+        yaml.dump(config, f)
+
+    mock_service = make_fake_drive({
+        'folder123': [doc('file1', 'Doc 1'), folder('sub_id', 'Sub'),
+                      {'id': 'md1', 'name': 'Doc 1.md', 'mimeType': 'text/markdown'},
+                      {'id': 'pdf1', 'name': 'Doc 1.pdf', 'mimeType': 'application/pdf'}],
+        'sub_id': [folder('deep_id', 'Deep')],
+        'deep_id': [doc('file2', 'Doc 2')],
+        'other': [doc('file9', 'Doc 9')],
+    })
+    mock_files = mock_service.files.return_value
+
+    with patch('src.main.CONFIG_FILE', str(config_file)), \
+         patch('src.main.STATE_FILE', mock_state), \
+         patch('os.getcwd', return_value=str(tmp_path)), \
+         patch('src.main.get_service', return_value=mock_service), \
+         patch('src.main.MediaIoBaseDownload', FakeDownloader), \
+         patch('src.main.print_conversion_report') as mock_report:
+
+        main.main(dry_run=False, traversal='tree', drive_id='shared1')
+
+    # A single listing covers the whole tree; only docs under the root are converted
+    assert mock_files.list.call_count == 1
+    assert mock_files.list.call_args.kwargs['driveId'] == 'shared1'
+    assert mock_report.call_args.args[0] == [('Doc 1', 'Doc 1'), ('Sub/Deep/Doc 2', 'Doc 2')]
+    # Parents came with the enumeration, so uploads needed no lookups
+    assert mock_files.get.call_count == 0
+    # Writes into the shared drive say they support shared drives, or Drive rejects them
+    writes = mock_files.create.call_args_list + mock_files.update.call_args_list
+    assert writes and all(c.kwargs.get('supportsAllDrives') for c in writes)
+
+def test_unknown_traversal_is_rejected(mock_config):
+    with patch('src.main.CONFIG_FILE', mock_config), \
+         patch('src.main.get_service') as mock_get_service:
+        main.main(traversal='tre')
+    assert mock_get_service.call_count == 0
+
+def test_unknown_state_backend_is_rejected(mock_config, mock_state):
+    with patch('src.main.CONFIG_FILE', mock_config), \
+         patch('src.main.STATE_FILE', mock_state), \
+         patch('src.main.get_service') as mock_get_service:
+        main.main(state_backend='sqlite3')
+    assert mock_get_service.call_count == 0
+    assert not os.path.exists(main.state_db_path())
+
+def test_list_folder_follows_pages():
+    mock_service = MagicMock()
+    mock_list = mock_service.files.return_value.list
+    mock_list.return_value.execute.side_effect = [
+        {'files': [doc('file1', 'Doc 1')], 'nextPageToken': 'page2'},
+        {'files': [folder('sub_id', 'Sub'), {'id': 'md1', 'name': 'Doc 1.md', 'mimeType': 'text/markdown'}]},
+    ]
+
+    tree = main.DriveTree()
+    main.list_folder(mock_service, tree, 'folder123')
+    main.list_folder(mock_service, tree, 'folder123')
+
+    assert [n.id for n in tree.children_of('folder123', main.DOC_MIME_TYPE)] == ['file1']
+    assert [n.id for n in tree.children_of('folder123', main.FOLDER_MIME_TYPE)] == ['sub_id']
+    assert tree.find_child('folder123', 'Doc 1.md').id == 'md1'
+    assert tree.find_child('folder123', 'Doc 1.pdf') is None
+    assert tree.parent_id('sub_id') == 'folder123'
+    assert mock_list.call_args_list[1].kwargs['pageToken'] == 'page2'
+    # An already listed folder is served from the tree
+    assert mock_list.call_count == 2
+
+def test_drive_tree_path_index(tmp_path):
+    mock_service = make_fake_drive({
+        'root': [folder('path_id', 'Path')],
+        'path_id': [folder('to_id', 'To')],
+        'to_id': [folder('folder123', 'Folder')],
+        'folder123': [doc('file1', 'Doc 1'), folder('sub_id', 'Sub')],
+        'sub_id': [folder('deeper_id', 'Deeper')],
+        'deeper_id': [doc('file2', 'Doc 2')],
+    })
+    tree = main.DriveTree()
+    assert main.resolve_path_to_id(mock_service, 'Path/To', tree=tree) == 'to_id'
+    assert tree.find_path('Path/To').id == 'to_id'
+
+    # Indexed prefixes are not looked up again
+    mock_list = mock_service.files.return_value.list
+    mock_list.reset_mock()
+    assert main.resolve_path_to_id(mock_service, 'Path/To/Folder', tree=tree) == 'folder123'
+    assert [c.kwargs['q'] for c in mock_list.call_args_list if 'name =' in c.kwargs['q']] == \
+        ["name = 'Folder' and 'to_id' in parents and mimeType = 'application/vnd.google-apps.folder' and trashed = false"]
+
+    converted_files = []
+    with patch('src.main.MediaIoBaseDownload', FakeDownloader), patch('src.main.save_state'):
+        main.scan_folder(mock_service, 'folder123', str(tmp_path), {}, converted_files=converted_files, tree=tree)
+
+    # Scanned folders are indexed below the scanned root; the report reads them back
+    assert tree.find_path('Sub/Deeper', base_id='folder123').id == 'deeper_id'
+    assert tree.path_of('deeper_id') == 'Sub/Deeper'
+    assert tree.find_path('Path/To/Folder').id == 'folder123'
+    assert sorted(converted_files) == [('Doc 1', 'Doc 1'), ('Sub/Deeper/Doc 2', 'Doc 2')]
+
+def test_drive_tree_is_compact():
+    import tracemalloc
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    tree = main.DriveTree()
+    for f in range(100):
+        tree.add(folder(f'{f:033d}', f'Folder {f}'), 'root')
+        for d in range(100):
+            tree.add(doc(f'd{f:05d}{d:027d}', f'Quarterly planning notes {f}-{d}'), f'{f:033d}')
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    assert len(tree) == 10101
+    assert tree.find_child(f'{5:033d}', 'Quarterly planning notes 5-7').id == f'd{5:05d}{7:027d}'
+    assert tree.parent_id(f'd{5:05d}{7:027d}') == f'{5:033d}'
+    # Keeps a million-node snapshot well under a gigabyte
+    assert used / len(tree) < 600
 
 def test_dry_run(mock_state, tmp_path):
     # Reuse config setup from fixture manually or mock it
@@ -254,24 +1279,32 @@ def test_dry_run(mock_state, tmp_path):
          patch('src.main.get_service') as mock_get_service, \
          patch('src.main.MediaIoBaseDownload') as mock_downloader_cls:
          
-        mock_service = MagicMock()
+        mock_service = make_fake_drive({
+            'folder123': [doc('file1', 'Doc 1', '2023-11-01T10:00:00Z')]
+        })
         mock_get_service.return_value = mock_service
         mock_files = mock_service.files.return_value
-        
-        scan_docs = {
-            'files': [
-                {'id': 'file1', 'name': 'Doc 1', 'modifiedTime': '2023-11-01T10:00:00Z'}
-            ]
-        }
-        scan_folders = {'files': []}
-        
-        mock_files.list.return_value.execute.side_effect = [scan_docs, scan_folders]
-        
+
         # Run with dry_run=True
         main.main(dry_run=True)
 
         # Verify download was NOT called
         assert mock_files.export_media.call_count == 0
+        assert mock_files.create.call_count == 0
+
+    # State is left untouched: no database is created and state.json is not migrated
+    assert not os.path.exists(os.path.splitext(mock_state)[0] + '.db')
+    assert not os.path.exists(mock_state + '.migrated')
+    with open(mock_state) as f:
+        assert json.load(f) == initial_state
+
+    # A dry run after a real one reads the database without writing to it
+    assert read_state(mock_state) == initial_state
+    db_path = os.path.splitext(mock_state)[0] + '.db'
+    modified = os.path.getmtime(db_path)
+    with patch('src.main.STATE_FILE', mock_state):
+        assert main.load_state(read_only=True) == initial_state
+    assert os.path.getmtime(db_path) == modified
 
 def test_print_conversion_report():
     """Test the conversion report output with log capture."""
@@ -331,6 +1364,18 @@ def test_print_conversion_report():
         log_capture.truncate(0)
         log_capture.seek(0)
 
+        # Test run stats lines
+        main.print_conversion_report([], dry_run=False, stats={'uploads_skipped_unchanged': 2})
+        captured = log_capture.getvalue()
+        assert 'Uploads skipped (content unchanged): 2' in captured
+
+        main.print_conversion_report([], dry_run=False, stats={'retries': 4})
+        assert 'Drive calls retried: 4' in log_capture.getvalue()
+
+        # Clear buffer
+        log_capture.truncate(0)
+        log_capture.seek(0)
+
         # Test backward compatibility (old string format)
         converted_files_old = ['Doc1.md', 'Doc2.md']
         main.print_conversion_report(converted_files_old, dry_run=False)